@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks
+    ~~~~~~~~~~
+
+    Benchmarks for ownpaste. They aren't installed with the package, run them
+    from the repository root, e.g.::
+
+        $ python -m benchmarks.language_detection
+
+    :copyright: (c) 2012-2013 by Rafael Goncalves Martins
+    :license: BSD, see LICENSE for more details.
+"""
@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.hot_paths
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Measures the latency and throughput of the request hot paths, using the
+    Flask test client over a SQLite database seeded with a synthetic corpus:
+    listing, HTML rendering, JSON, raw content, POST with language guessing
+    and the full digest authentication flow.
+
+    The corpus is generated from a random seed, then runs with the same
+    options are comparable. Results can be saved as JSON, and compared with
+    a previous run::
+
+        $ python -m benchmarks.hot_paths -o before.json
+        $ python -m benchmarks.hot_paths -o after.json -c before.json
+
+    :copyright: (c) 2012-2013 by Rafael Goncalves Martins
+    :license: BSD, see LICENSE for more details.
+"""
+
+from datetime import datetime
+from ownpaste import create_app
+from ownpaste.auth import HTTPDigestAuth
+from ownpaste.models import Paste, db
+
+import argparse
+import json
+import os
+import platform
+import pygments
+import random
+import re
+import sqlalchemy
+import sys
+import tempfile
+import time
+
+PASSWORD = 'benchmark'
+
+# options that must match for results to be comparable
+CORPUS_OPTIONS = ('pastes', 'size_median', 'size_sigma', 'size_max',
+                  'languages', 'private_ratio', 'seed')
+
+# lines used to build the synthetic pastes, by language
+LINES = {
+    'python': [
+        'def func_%(n)i(arg, *args, **kwargs):',
+        '    """Docstring of the function %(n)i."""',
+        '    value = [i * %(n)i for i in range(arg) if i %% 2]',
+        '    return dict(value=value, name="item-%(n)i")',
+        'class Foo%(n)i(object):',
+        '    # comment number %(n)i',
+    ],
+    'c': [
+        '#include <stdio.h>',
+        'static int func_%(n)i(const char *arg, size_t len)',
+        '{',
+        '    for (size_t i = 0; i < len; i++) { /* %(n)i */ }',
+        '    return printf("%%s: %(n)i\\n", arg);',
+        '}',
+    ],
+    'bash': [
+        'for i in $(seq 1 %(n)i); do',
+        '    echo "line ${i}: %(n)i" >> "${OUTPUT}"',
+        'done',
+        'if [[ -f "/tmp/file-%(n)i" ]]; then rm -f "/tmp/file-%(n)i"; fi',
+        'export VAR_%(n)i="value"  # comment',
+    ],
+    'javascript': [
+        'function func%(n)i(arg) {',
+        '    const value = [1, 2, %(n)i].map((i) => i * arg);',
+        '    return {value: value, name: "item-%(n)i"};',
+        '}',
+        '// comment number %(n)i',
+    ],
+    'diff': [
+        'diff --git a/file%(n)i.txt b/file%(n)i.txt',
+        '--- a/file%(n)i.txt',
+        '+++ b/file%(n)i.txt',
+        '@@ -%(n)i,3 +%(n)i,3 @@',
+        '-removed line %(n)i',
+        '+added line %(n)i',
+        ' context line %(n)i',
+    ],
+    'text': [
+        '2013-01-01 12:00:%(n)02i INFO server: request %(n)i served',
+        '2013-01-01 12:00:%(n)02i WARNING server: slow request %(n)i',
+        'Lorem ipsum dolor sit amet, consectetur adipiscing elit %(n)i.',
+    ],
+}
+
+FILE_NAMES = {
+    'python': 'module.py',
+    'c': 'main.c',
+    'bash': 'script.sh',
+    'javascript': 'app.js',
+    'diff': 'fix.patch',
+    'text': None,
+}
+
+
+def generate_content(rand, language, size):
+    lines = LINES[language]
+    rv = []
+    length = 0
+    while length < size:
+        line = rand.choice(lines) % dict(n=rand.randint(0, 59))
+        rv.append(line)
+        length += len(line) + 1
+    return '\n'.join(rv) + '\n'
+
+
+def generate_size(rand, median, sigma, max_size):
+    return max(1, min(int(rand.lognormvariate(0, sigma) * median),
+                      max_size))
+
+
+class Benchmark(object):
+
+    def __init__(self, args):
+        self.args = args
+        self.rand = random.Random(args.seed)
+        fd, self.db_file = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.app = create_app()
+        self.app.config.update(
+            SQLALCHEMY_DATABASE_URI='sqlite:///' + self.db_file,
+            PASSWORD=HTTPDigestAuth().a1(PASSWORD, 'ownpaste', 'ownpaste'),
+            USERNAME='ownpaste', REALM='ownpaste', RENDER_WORKERS=0,
+            IP_BLOCK_HITS=1000000)
+        self.client = self.app.test_client()
+        self.public_ids = []
+        self.private_ids = []
+
+    def close(self):
+        os.unlink(self.db_file)
+
+    def seed(self):
+        args = self.args
+        languages = args.languages.split(',')
+        with self.app.app_context():
+            db.create_all()
+            for i in range(args.pastes):
+                language = self.rand.choice(languages)
+                size = generate_size(self.rand, args.size_median,
+                                     args.size_sigma, args.size_max)
+                paste = Paste(generate_content(self.rand, language, size),
+                              FILE_NAMES[language], language,
+                              self.rand.random() < args.private_ratio)
+                db.session.add(paste)
+                if i % 500 == 499:
+                    db.session.commit()
+            db.session.commit()
+            for paste_id, private_id in db.session.query(Paste.paste_id,
+                                                         Paste.private_id):
+                if private_id is None:
+                    self.public_ids.append(str(paste_id))
+                else:
+                    self.private_ids.append(private_id)
+
+    def paste_id(self):
+        ids = self.public_ids
+        if self.private_ids and \
+           self.rand.random() < self.args.private_ratio:
+            ids = self.private_ids
+        return self.rand.choice(ids)
+
+    def digest(self, method, url, **kwargs):
+        '''Runs the full digest authentication flow: the request is
+        challenged, then repeated with the credentials.'''
+        response = getattr(self.client, method)(url, **kwargs)
+        if response.status_code != 401:
+            return response
+        challenge = dict(re.findall(r'(\w+)="?([^",]+)"?',
+                                    response.headers['WWW-Authenticate']))
+        h = HTTPDigestAuth().hash
+        a1 = h('ownpaste', challenge['realm'], PASSWORD)
+        a2 = h(method.upper(), url)
+        cnonce = '%016x' % self.rand.getrandbits(64)
+        auth = ('Digest username="ownpaste", realm="%s", nonce="%s", '
+                'uri="%s", response="%s", qop=auth, nc=00000001, '
+                'cnonce="%s"' % (challenge['realm'], challenge['nonce'], url,
+                                 h(a1, challenge['nonce'], '00000001', cnonce,
+                                   'auth', a2), cnonce))
+        headers = dict(kwargs.pop('headers', {}), Authorization=auth)
+        return getattr(self.client, method)(url, headers=headers, **kwargs)
+
+    def token(self):
+        response = self.digest('post', '/token/')
+        return response.get_json()['token']
+
+    def scenarios(self):
+        json_headers = {'Accept': 'application/json'}
+        pages = max(1, len(self.public_ids) // self.app.config['PER_PAGE'])
+        languages = self.args.languages.split(',')
+        bearer = {'Authorization': 'Bearer ' + self.token(),
+                  'Accept': 'application/json'}
+
+        def listing():
+            return self.client.get('/paste/?page=%i' %
+                                   self.rand.randint(1, pages))
+
+        def listing_cursor():
+            before = self.rand.randint(1, self.args.pastes)
+            return self.client.get('/paste/?before=%i' % before,
+                                   headers=json_headers)
+
+        def html():
+            return self.client.get('/paste/%s/' % self.paste_id())
+
+        def json_():
+            return self.client.get('/paste/%s/' % self.paste_id(),
+                                   headers=json_headers)
+
+        def raw():
+            return self.client.get('/paste/%s/raw/' % self.paste_id())
+
+        def post():
+            language = self.rand.choice(languages)
+            size = generate_size(self.rand, self.args.size_median,
+                                 self.args.size_sigma, self.args.size_max)
+            data = dict(file_content=generate_content(self.rand, language,
+                                                      size))
+            if self.rand.random() < 0.5:
+                data['file_name'] = FILE_NAMES[language]
+            return self.client.post('/paste/', data=json.dumps(data),
+                                    content_type='application/json',
+                                    headers=bearer)
+
+        def digest_auth():
+            return self.digest('get', '/paste/?private=1',
+                               headers=json_headers)
+
+        return [('listing', listing), ('listing_cursor', listing_cursor),
+                ('html', html), ('json', json_), ('raw', raw),
+                ('post', post), ('digest_auth', digest_auth)]
+
+    def measure(self, func):
+        for i in range(self.args.warmup):
+            func().close()
+        timings = []
+        start = time.perf_counter()
+        for i in range(self.args.requests):
+            t = time.perf_counter()
+            response = func()
+
+            # streamed bodies are only read, and decompressed, when consumed
+            response.get_data()
+            response.close()
+            timings.append(time.perf_counter() - t)
+            if response.status_code != 200:
+                raise RuntimeError('Unexpected response: %s' %
+                                   response.status)
+        total = time.perf_counter() - start
+        timings.sort()
+
+        def percentile(p):
+            return timings[min(len(timings) - 1,
+                               int(round(p / 100.0 * len(timings))))] * 1000
+
+        return dict(requests=len(timings), p50=percentile(50),
+                    p95=percentile(95), p99=percentile(99),
+                    mean=sum(timings) / len(timings) * 1000,
+                    throughput=len(timings) / total)
+
+    def run(self):
+        results = {}
+        with self.app.app_context():
+            for name, func in self.scenarios():
+                results[name] = self.measure(func)
+        return results
+
+
+def print_results(results, baseline=None):
+    header = '%-16s %8s %10s %10s %10s %10s' % ('', 'requests', 'p50',
+                                                 'p95', 'p99', 'req/s')
+    print(header)
+    for name, result in results.items():
+        print('%-16s %8i %7.2f ms %7.2f ms %7.2f ms %10.1f' % (
+            name, result['requests'], result['p50'], result['p95'],
+            result['p99'], result['throughput']))
+        if baseline is not None and name in baseline:
+            base = baseline[name]
+            print('%-16s %8s %9s%% %9s%% %9s%% %9s%%' % (
+                '  vs baseline', '',
+                *['%+.1f' % ((result[key] / base[key] - 1) * 100)
+                  for key in ('p50', 'p95', 'p99', 'throughput')]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[4])
+    parser.add_argument('-n', '--pastes', type=int, default=2000,
+                        help='number of pastes in the corpus')
+    parser.add_argument('--size-median', type=int, default=2048,
+                        help='median paste size, in bytes. Sizes are '
+                        'log-normally distributed')
+    parser.add_argument('--size-sigma', type=float, default=1.0,
+                        help='sigma of the paste size distribution')
+    parser.add_argument('--size-max', type=int, default=262144,
+                        help='maximum paste size, in bytes')
+    parser.add_argument('--languages', default=','.join(sorted(LINES)),
+                        help='comma-separated languages of the corpus. '
+                        'Available: %s' % ', '.join(sorted(LINES)))
+    parser.add_argument('--private-ratio', type=float, default=0.1,
+                        help='ratio of private pastes')
+    parser.add_argument('-r', '--requests', type=int, default=200,
+                        help='measured requests per scenario')
+    parser.add_argument('-w', '--warmup', type=int, default=10,
+                        help='requests per scenario before measuring')
+    parser.add_argument('-s', '--seed', type=int, default=42)
+    parser.add_argument('-o', '--output', help='save the results as JSON')
+    parser.add_argument('-c', '--compare',
+                        help='JSON results of a previous run, to compare')
+    args = parser.parse_args()
+
+    for language in args.languages.split(','):
+        if language not in LINES:
+            parser.error('unsupported language: %s' % language)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as fp:
+            data = json.load(fp)
+        baseline = data['results']
+        for key in CORPUS_OPTIONS:
+            if data['options'].get(key) != getattr(args, key):
+                print('Warning: the baseline was run with a different '
+                      '%s' % key, file=sys.stderr)
+
+    benchmark = Benchmark(args)
+    try:
+        start = time.perf_counter()
+        benchmark.seed()
+        print('Corpus seeded in %.2f s.' % (time.perf_counter() - start),
+              file=sys.stderr)
+        results = benchmark.run()
+    finally:
+        benchmark.close()
+
+    print_results(results, baseline)
+    if args.output is not None:
+        with open(args.output, 'w') as fp:
+            json.dump(dict(
+                date=datetime.utcnow().isoformat(),
+                options=vars(args),
+                versions=dict(python=platform.python_version(),
+                              pygments=pygments.__version__,
+                              sqlalchemy=sqlalchemy.__version__),
+                results=results), fp, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.language_detection
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Compares the accuracy and speed of the tiered language detection with
+    the previous implementation, that ran Pygments' guessers over the whole
+    paste content.
+
+    :copyright: (c) 2012-2013 by Rafael Goncalves Martins
+    :license: BSD, see LICENSE for more details.
+"""
+
+from fnmatch import fnmatch
+from ownpaste.lexers import get_index, guess_language
+from pygments.lexers import TextLexer, guess_lexer, guess_lexer_for_filename
+
+import argparse
+import time
+
+# (expected language, file name, content)
+CORPUS = [
+    ('python', 'setup.py', 'from setuptools import setup\n\nsetup()\n'),
+    ('python', None, '#!/usr/bin/env python3\nimport sys\nprint(sys.argv)\n'),
+    ('bash', None, '#!/bin/bash\nset -e\necho "hello"\n'),
+    ('bash', 'deploy', '#!/bin/sh\nexec ./run\n'),
+    ('c', 'main.c', '#include <stdio.h>\nint main(void) { return 0; }\n'),
+    ('cpp', 'main.cpp', '#include <iostream>\nint main() { return 0; }\n'),
+    ('make', 'Makefile', 'all:\n\t$(CC) -o foo foo.c\n'),
+    ('html', 'index.html', '<!DOCTYPE html>\n<html><body></body></html>\n'),
+    ('html', None, '<!DOCTYPE html>\n<html><body></body></html>\n'),
+    ('yaml', 'config.yml', 'foo:\n  bar: 1\n'),
+    ('json', 'package.json', '{"name": "foo", "version": "1.0.0"}\n'),
+    ('ruby', None, '# -*- mode: ruby -*-\nputs "hello"\n'),
+    ('python', None, 'print("hello")\n# vim: set ft=python:\n'),
+    ('perl', None, '#!/usr/bin/perl\nprint "hello\\n";\n'),
+    ('php', None, '<?php\necho "hello";\n'),
+    ('diff', 'fix.patch', '--- a/foo\n+++ b/foo\n@@ -1 +1 @@\n-a\n+b\n'),
+    ('diff', None, 'diff --git a/foo b/foo\n--- a/foo\n+++ b/foo\n'
+                   '@@ -1 +1 @@\n-a\n+b\n'),
+    ('text', 'server.log', '2013-01-01 00:00:00 INFO started\n' * 20),
+    ('restructuredtext', 'README.rst', 'Title\n=====\n\nSome text.\n'),
+    ('ini', 'setup.cfg', '[metadata]\nname = foo\n'),
+]
+
+
+def legacy_guess_language(file_content, file_name=None):
+    if file_name is None:
+        lexer = guess_lexer(file_content)
+    else:
+        try:
+            lexer = guess_lexer_for_filename(file_name, file_content)
+        except Exception:
+            lexer = guess_lexer(file_content)
+        found = False
+        for pattern in lexer.filenames:
+            if fnmatch(file_name, pattern):
+                found = True
+                break
+        else:
+            found = True
+        if not found:
+            lexer = TextLexer
+    return lexer.aliases[0]
+
+
+def measure(func, *args):
+    start = time.perf_counter()
+    rv = func(*args)
+    return rv, time.perf_counter() - start
+
+
+def run(repeat, log_lines):
+    # warm up the lexer index and the pygments lexer modules, then the first
+    # measurement doesn't pay for the imports.
+    get_index()
+    guess_language('warm up', timeout=None)
+    legacy_guess_language('warm up')
+
+    corpus = CORPUS + [('text', None, '2013-01-01 00:00:00 INFO request '
+                        'served in 12ms\n' * log_lines)]
+    results = dict(legacy=[0, 0.0], tiered=[0, 0.0])
+    for expected, file_name, file_content in corpus:
+        for name, func in (('legacy', legacy_guess_language),
+                           ('tiered', guess_language)):
+            times = []
+            for i in range(repeat):
+                rv, elapsed = measure(func, file_content, file_name)
+                times.append(elapsed)
+            results[name][0] += int(rv == expected)
+            results[name][1] += min(times)
+            print('%-7s %-12s %-14s -> %-14s %8.2f ms' % (
+                name, expected, file_name or '(no name)', rv,
+                min(times) * 1000))
+    print()
+    for name, (hits, elapsed) in sorted(results.items()):
+        print('%-7s accuracy: %2i/%i  total: %8.2f ms' % (
+            name, hits, len(corpus), elapsed * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[4])
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='runs per sample, the best one is reported')
+    parser.add_argument('-l', '--log-lines', type=int, default=10000,
+                        help='lines of the synthetic log paste')
+    args = parser.parse_args()
+    run(args.repeat, args.log_lines)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.startup
+    ~~~~~~~~~~~~~~~~~~
+
+    Measures the startup time of ownpaste: ``import ownpaste``,
+    ``create_app()`` and the first request to ``/``, that builds the
+    languages table, with and without a languages snapshot. Each sample runs
+    on a new Python interpreter.
+
+    :copyright: (c) 2012-2013 by Rafael Goncalves Martins
+    :license: BSD, see LICENSE for more details.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT = '''
+import time
+start = time.perf_counter()
+import ownpaste
+imported = time.perf_counter()
+app = ownpaste.create_app()
+app.config['LANGUAGES_SNAPSHOT'] = %(snapshot)r
+created = time.perf_counter()
+with app.app_context():
+    ownpaste.utils.get_languages()
+languages = time.perf_counter()
+print(imported - start, created - imported, languages - created)
+'''
+
+
+def sample(snapshot):
+    output = subprocess.check_output(
+        [sys.executable, '-c', SCRIPT % dict(snapshot=snapshot)], cwd=cwd)
+    return [float(i) for i in output.split()]
+
+
+def run(repeat):
+    fd, snapshot = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    subprocess.check_call(
+        [sys.executable, '-c', 'from ownpaste.utils import build_languages, '
+         'save_languages_snapshot; save_languages_snapshot(%r, '
+         'build_languages())' % snapshot], cwd=cwd)
+    try:
+        print('%-12s %12s %12s %12s' % ('', 'import', 'create_app',
+                                        'languages'))
+        for name, file_name in (('no snapshot', None),
+                                ('snapshot', snapshot)):
+            samples = [sample(file_name) for i in range(repeat)]
+            best = [min(i) * 1000 for i in zip(*samples)]
+            print('%-12s %9.2f ms %9.2f ms %9.2f ms' % tuple([name] + best))
+    finally:
+        os.unlink(snapshot)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[4])
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='runs per sample, the best one is reported')
+    args = parser.parse_args()
+    run(args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -16,10 +16,16 @@ warnings.filterwarnings('ignore', r'module.*already imported', UserWarning)
 from flask import Flask, _request_ctx_stack
 from flask_script import Manager
 from werkzeug.exceptions import default_exceptions
+from ownpaste.assets import Stylesheets
 from ownpaste.auth import HTTPDigestAuth
-from ownpaste.script import GeneratePw, DbVersionControl, DbUpgrade, \
-     DbDowngrade, DbVersion
-from ownpaste.models import Ip, Paste, db
+from ownpaste.highlight import cache as highlight_cache
+from ownpaste.metrics import init_app as init_metrics
+from ownpaste.reaper import init_app as init_reaper
+from ownpaste.script import GeneratePw, LanguagesSnapshot, Recompress, \
+     Export, Import, Reap, Recount, Reindex, Serve, DbVersionControl, \
+     DbUpgrade, DbDowngrade, DbVersion
+from ownpaste.models import Blob, Ip, Paste, PasteCounter, RenderedPaste, \
+     db
 from ownpaste.utils import error_handler
 from ownpaste.views import views
 
@@ -34,16 +40,50 @@ def create_app(config_file=None):
     auth = HTTPDigestAuth()
     app.config.setdefault('PYGMENTS_STYLE', 'friendly')
     app.config.setdefault('PYGMENTS_LINENOS', True)
+    app.config.setdefault('HIGHLIGHT_CACHE_SIZE', 128)
+    app.config.setdefault('HIGHLIGHT_CACHE_DIR', None)
+    app.config.setdefault('RENDER_WORKERS', 2)
+    app.config.setdefault('LANGUAGE_GUESS_SAMPLE', 16384)  # in characters
+    app.config.setdefault('LANGUAGE_GUESS_TIMEOUT', 0.2)  # in seconds
+    app.config.setdefault('LANGUAGES_SNAPSHOT', None)
+    app.config.setdefault('CONTENT_COMPRESSION', None)
+    app.config.setdefault('CONTENT_COMPRESSION_MIN_SIZE', 1024)  # in bytes
+    app.config.setdefault('STREAM_CHUNK_SIZE', 65536)  # in bytes
+    app.config.setdefault('PASTE_WINDOW_LINES', 1000)
     app.config.setdefault('PER_PAGE', 20)
+    app.config.setdefault('PER_PAGE_MAX', 100)
+    app.config.setdefault('BULK_MAX_ITEMS', 500)
+    app.config.setdefault('BULK_WORKERS', 2)
+    app.config.setdefault('PRIVATE_ID_POOL_SIZE', 256)
+    app.config.setdefault('SEARCH_INDEX_MAX_SIZE', 262144)  # in characters
+    app.config.setdefault('REAPER_INTERVAL', None)
+    app.config.setdefault('REAPER_BATCH_SIZE', 500)
+    app.config.setdefault('SERVE_WORKERS', 4)
+    app.config.setdefault('SERVE_WARMUP_LANGUAGES', None)
+    app.config.setdefault('SERVER_TIMING', True)
     app.config.setdefault('SQLALCHEMY_DATABASE_URI',
                           'sqlite:////tmp/ownpaste.db')
     app.config.setdefault('SQLALCHEMY_TRACK_MODIFICATIONS', False)
+    app.config.setdefault('SQLITE_POOL_SIZE', 5)
+    app.config.setdefault('SQLITE_PRAGMAS', {
+        'busy_timeout': 5000,  # in milliseconds
+        'journal_mode': 'wal',
+        'synchronous': 'normal',
+        'mmap_size': 268435456,  # in bytes
+        'cache_size': -16384,  # in kibibytes
+    })
     app.config.setdefault('REALM', 'ownpaste')
     app.config.setdefault('USERNAME', 'ownpaste')
     app.config.setdefault('PASSWORD', auth.a1('test', app.config['USERNAME'],
                                               app.config['REALM']))
     app.config.setdefault('IP_BLOCK_HITS', 10)
     app.config.setdefault('IP_BLOCK_TIMEOUT', 60)  # in minutes
+    app.config.setdefault('IP_BLOCK_WINDOW', 60)  # in minutes
+    app.config.setdefault('AUTH_THROTTLE_BACKEND', 'database')
+    app.config.setdefault('AUTH_THROTTLE_FLUSH_INTERVAL', 5)  # in seconds
+    app.config.setdefault('AUTH_NONCE_EXPIRY', 300)  # in seconds
+    app.config.setdefault('AUTH_TOKEN_EXPIRY', 3600)  # in seconds
+    app.config.setdefault('SECRET_KEY', None)
     app.config.setdefault('TIMEZONE', 'UTC')
     app.config.from_envvar('OWNPASTE_SETTINGS', True)
     if config_file is not None:
@@ -58,6 +98,11 @@ def create_app(config_file=None):
     app.register_error_handler(401, auth.challenge)
 
     app.register_blueprint(views)
+    init_metrics(app)
+    init_reaper(app)
+
+    # stylesheets are built once, and served from memory
+    app.extensions['ownpaste_stylesheets'] = Stylesheets.build(app)
 
     @app.before_first_request
     def before_first_request():
@@ -74,9 +119,20 @@ def create_script():
 
     @manager.shell
     def _make_context():
-        return dict(app=_request_ctx_stack.top.app, db=db, Paste=Paste, Ip=Ip)
+        return dict(app=_request_ctx_stack.top.app, db=db, Paste=Paste, Ip=Ip,
+                    Blob=Blob, RenderedPaste=RenderedPaste,
+                    PasteCounter=PasteCounter,
+                    highlight_cache=highlight_cache)
 
     manager.add_command('generatepw', GeneratePw())
+    manager.add_command('languages_snapshot', LanguagesSnapshot())
+    manager.add_command('recompress', Recompress())
+    manager.add_command('export', Export())
+    manager.add_command('import', Import())
+    manager.add_command('reap', Reap())
+    manager.add_command('recount', Recount())
+    manager.add_command('reindex', Reindex())
+    manager.add_command('serve', Serve())
     manager.add_command('db_version_control', DbVersionControl())
     manager.add_command('db_upgrade', DbUpgrade())
     manager.add_command('db_downgrade', DbDowngrade())
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+    ownpaste.assets
+    ~~~~~~~~~~~~~~~
+
+    Module with the stylesheets, built once when the application is created.
+
+    Stylesheets are served from memory, with the content hash in their file
+    names, then they can be cached forever by browsers.
+
+    :copyright: (c) 2012-2013 by Rafael Goncalves Martins
+    :license: BSD, see LICENSE for more details.
+"""
+
+from hashlib import sha1
+from pygments.formatters import HtmlFormatter
+
+import gzip
+import io
+import os
+
+
+class Stylesheet(object):
+
+    def __init__(self, name, content):
+        self.name = name
+        self.content = content
+        self.gzip_content = gzip.compress(content, mtime=0)
+        self.etag = sha1(content).hexdigest()
+        self.filename = '%s.%s.css' % (name, self.etag[:12])
+
+
+class Stylesheets(object):
+    '''Registry of stylesheets, by name and by fingerprinted file name.'''
+
+    def __init__(self):
+        self.by_name = {}
+        self.by_filename = {}
+
+    def add(self, name, content):
+        stylesheet = Stylesheet(name, content)
+        self.by_name[name] = stylesheet
+        self.by_filename[stylesheet.filename] = stylesheet
+        return stylesheet
+
+    @classmethod
+    def build(cls, app):
+        rv = cls()
+        with io.open(os.path.join(app.static_folder, 'styles.css'),
+                     'rb') as fp:
+            rv.add('styles', fp.read())
+        formatter = HtmlFormatter(style=app.config['PYGMENTS_STYLE'])
+        rv.add('pygments', formatter.get_style_defs(('#paste', '.syntax'))
+               .encode('utf-8'))
+        return rv
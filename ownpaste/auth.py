@@ -9,14 +9,50 @@
     :license: BSD, see LICENSE for more details.
 """
 
-from datetime import datetime, timedelta
-from flask import abort, current_app, make_response, request
-from hashlib import md5
-from ownpaste.models import Ip, db
+from collections import OrderedDict
+from flask import abort, current_app, g, make_response, request
+from hashlib import md5, sha256
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from ownpaste.metrics import auth_blocked_requests, auth_blocks, \
+     auth_failures, timed
+from ownpaste.throttle import get_store
 from ownpaste.utils import jsonify, request_wants_json
 
 import binascii
+import hmac
 import os
+import threading
+import time
+
+
+class NonceCounters(object):
+    '''Tracks the last request counter (``nc``) seen for each nonce, to
+    reject replayed requests.
+
+    At most ``max_entries`` nonces are tracked, the least recently used ones
+    being forgotten first. Nonces expire anyway, then forgotten nonces can
+    only be replayed until they expire.
+    '''
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.counters = OrderedDict()
+
+    def update(self, nonce, nc):
+        '''Returns False if the counter was already used for the nonce.'''
+        with self.lock:
+            last = self.counters.get(nonce, 0)
+            if nc <= last:
+                return False
+            self.counters[nonce] = nc
+            self.counters.move_to_end(nonce)
+            while len(self.counters) > self.max_entries:
+                self.counters.popitem(last=False)
+            return True
+
+
+nonce_counters = NonceCounters()
 
 
 class HTTPDigestAuth(object):
@@ -40,8 +76,66 @@ class HTTPDigestAuth(object):
                          cnonce or request.authorization.cnonce,
                          qop or request.authorization.qop, a2 or self.a2())
 
+    def secret(self):
+        # the password hash is already a secret, then it is used if no
+        # secret key is configured
+        rv = current_app.config['SECRET_KEY'] or \
+            current_app.config['PASSWORD']
+        if not isinstance(rv, bytes):
+            rv = rv.encode('utf-8')
+        return rv
+
+    def nonce_signature(self, timestamp, salt):
+        msg = ':'.join([timestamp, salt, current_app.config['REALM']])
+        return hmac.new(self.secret(), msg.encode('utf-8'),
+                        sha256).hexdigest()
+
+    def create_nonce(self):
+        timestamp = '%x' % int(time.time())
+        salt = binascii.hexlify(os.urandom(4)).decode('utf-8')
+        return '%s.%s.%s' % (timestamp, salt,
+                             self.nonce_signature(timestamp, salt))
+
+    def nonce_timestamp(self, nonce):
+        '''Returns the creation time of the nonce, or None if it wasn't
+        created by us.'''
+        try:
+            timestamp, salt, signature = nonce.split('.')
+            created = int(timestamp, 16)
+        except (AttributeError, ValueError):
+            return None
+        expected = self.nonce_signature(timestamp, salt)
+        if not hmac.compare_digest(signature.encode('utf-8'),
+                                   expected.encode('utf-8')):
+            return None
+        return created
+
+    def token_serializer(self):
+        return URLSafeTimedSerializer(self.secret(), salt='ownpaste-token')
+
+    def create_token(self):
+        '''Creates a signed bearer token, accepted by ``required`` until it
+        expires.'''
+        return self.token_serializer().dumps(
+            dict(u=current_app.config['USERNAME']))
+
+    def verify_token(self, token):
+        expiry = int(current_app.config['AUTH_TOKEN_EXPIRY'])
+        try:
+            data = self.token_serializer().loads(token, max_age=expiry)
+        except BadSignature:
+            return False
+        return isinstance(data, dict) and \
+            data.get('u') == current_app.config['USERNAME']
+
+    def bearer_token(self):
+        auth_type, _, token = request.headers.get('Authorization', '') \
+            .partition(' ')
+        if auth_type.lower() == 'bearer':
+            return token.strip()
+        return None
+
     def challenge(self, error):
-        ip = Ip.get(request.remote_addr)
         if request_wants_json():
             response = jsonify(dict(status='fail',
                                     error='Authentication required'))
@@ -49,14 +143,12 @@ class HTTPDigestAuth(object):
             response = make_response(error.get_body(request.environ))
 
         # create nonce. the client should return the request with the
-        # authentication data and the same nonce
-        ip.nonce = binascii.hexlify(os.urandom(8)).decode('utf-8')
-        db.session.commit()
-
-        # set digest response
+        # authentication data and the same nonce. the nonce is signed, then
+        # it doesn't need to be stored.
         response.www_authenticate.set_digest(realm=current_app.config['REALM'],
-                                             nonce=ip.nonce, qop=['auth'],
-                                             algorithm='MD5')
+                                             nonce=self.create_nonce(),
+                                             qop=['auth'], algorithm='MD5',
+                                             stale=g.get('nonce_stale', False))
         response.status_code = 401
         return response
 
@@ -69,26 +161,24 @@ class HTTPDigestAuth(object):
             return False
         return True
 
-    def required(self):
-        # get the ip object from the database, or create it if needed
-        ip = Ip.get(request.remote_addr)
+    @timed('auth')
+    def required(self, allow_token=True):
 
-        # verify the ip status
-        if ip.blocked:
+        # bearer tokens are verified by their signature, without challenge
+        token = self.bearer_token()
+        if token is not None and allow_token:
+            if not self.verify_token(token):
+                auth_failures.inc('token')
+                abort(401)
+            return
 
-            # evaluate the timeout
-            timeout = float(current_app.config['IP_BLOCK_TIMEOUT'])
-            timeout_delta = timedelta(minutes=timeout)
+        store = get_store()
+        ip = request.remote_addr
 
-            # if the ip is still banned
-            if ip.blocked_date + timeout_delta > datetime.utcnow():
-
-                # return 'forbidden'
-                abort(403)
-
-            # ban timeout expired
-            ip.blocked = False
-            db.session.commit()
+        # if the ip is still banned, return 'forbidden'
+        if store.blocked(ip):
+            auth_blocked_requests.inc()
+            abort(403)
 
         auth = request.authorization
 
@@ -96,29 +186,39 @@ class HTTPDigestAuth(object):
         if auth is None or auth.response is None:
             abort(401)
 
-        # verify if the client returned the sended nonce
-        if ip.nonce is not None and ip.nonce.lower() != auth.nonce.lower():
+        # verify if the client returned a nonce sent by us
+        created = self.nonce_timestamp(auth.nonce)
+        if created is None:
             abort(400)
 
+        # expired nonces are challenged again, flagged as stale, then clients
+        # can retry without asking for user/password
+        expiry = float(current_app.config['AUTH_NONCE_EXPIRY'])
+        if not created <= time.time() < created + expiry:
+            g.nonce_stale = True
+            abort(401)
+
         # if user or password are wrong
         if not self.verify_auth():
 
-            # we had a bad user/password, then let's increase the hit counter
-            ip.hits += 1
-            db.session.commit()
-
-            # we need to block the ip?
-            if ip.hits >= int(current_app.config['IP_BLOCK_HITS']):
-
-                # block it
-                ip.blocked = True
-                db.session.commit()
+            # we had a bad user/password, then let's increase the hit counter,
+            # blocking the ip if needed
+            auth_failures.inc('digest')
+            if store.failure(ip):
+                auth_blocks.inc()
                 abort(403)
 
             # we want authentication!!
             abort(401)
 
+        # reject replayed requests
+        try:
+            nc = int(auth.nc, 16)
+        except (TypeError, ValueError):
+            abort(400)
+        if not nonce_counters.update(auth.nonce, nc):
+            abort(400)
+
         # validation passed! user autenticated!
-        # at this point we can drop the ip from the table :)
-        db.session.delete(ip)
-        db.session.commit()
+        # at this point we can forget the ip :)
+        store.success(ip)
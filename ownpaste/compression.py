@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+    ownpaste.compression
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Module with the codecs used to compress paste contents at rest.
+
+    ``gzip`` is always available, and its output can be sent as-is to clients
+    accepting gzip content encoding. ``zstd`` requires the ``zstandard``
+    package.
+
+    :copyright: (c) 2012-2013 by Rafael Goncalves Martins
+    :license: BSD, see LICENSE for more details.
+"""
+
+import gzip
+import io
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def _zstd_compress(data):
+    return zstandard.ZstdCompressor().compress(data)
+
+
+def _zstd_decompress(data):
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+def _zstd_reader(fileobj):
+    return zstandard.ZstdDecompressor().stream_reader(fileobj)
+
+
+def _gzip_reader(fileobj):
+    return gzip.GzipFile(fileobj=fileobj, mode='rb')
+
+
+# codec name -> (compress, decompress, open a file object to read the
+# decompressed data)
+CODECS = {
+    'gzip': (lambda data: gzip.compress(data, mtime=0), gzip.decompress,
+             _gzip_reader),
+}
+
+if zstandard is not None:
+    CODECS['zstd'] = (_zstd_compress, _zstd_decompress, _zstd_reader)
+
+
+class ChunkReader(io.RawIOBase):
+    '''File-like object reading from an iterable of byte strings.'''
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.buffer:
+            try:
+                self.buffer = next(self.chunks)
+            except StopIteration:
+                return 0
+        size = min(len(b), len(self.buffer))
+        b[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+
+def compress(codec, data):
+    try:
+        return CODECS[codec][0](data)
+    except KeyError:
+        raise ValueError('Unsupported compression codec: %s' % codec)
+
+
+def decompress(codec, data):
+    try:
+        return CODECS[codec][1](data)
+    except KeyError:
+        raise ValueError('Unsupported compression codec: %s' % codec)
+
+
+def decompress_chunks(codec, chunks, chunk_size):
+    '''Decompresses an iterable of byte strings, yielding chunks of at most
+    ``chunk_size`` bytes, then highly compressible data doesn't expand in
+    memory.'''
+    try:
+        open_reader = CODECS[codec][2]
+    except KeyError:
+        raise ValueError('Unsupported compression codec: %s' % codec)
+    with open_reader(ChunkReader(chunks)) as reader:
+        while 1:
+            chunk = reader.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+    ownpaste.highlight
+    ~~~~~~~~~~~~~~~~~~
+
+    Module with syntax highlighting helpers and the rendered HTML cache.
+
+    :copyright: (c) 2012-2013 by Rafael Goncalves Martins
+    :license: BSD, see LICENSE for more details.
+"""
+
+from collections import OrderedDict
+from flask import current_app
+from hashlib import sha1
+from pygments import highlight
+from pygments.formatters import HtmlFormatter
+
+import glob
+import io
+import os
+import tempfile
+import threading
+
+
+def render(file_content, lexer, style, linenos):
+    formatter = HtmlFormatter(linenos=linenos, anchorlinenos=linenos,
+                              style=style, lineanchors='op',
+                              cssclass='syntax')
+    return highlight(file_content, lexer, formatter)
+
+
+def render_lines(file_content, lexer):
+    '''Returns the highlighted HTML of each line, without line numbers.
+
+    The whole content is highlighted, then the lexer state is right for every
+    line, e.g. inside multi-line strings. Pygments closes the open tags at
+    the end of each line, then any range of lines is valid HTML.
+    '''
+    html = highlight(file_content, lexer, HtmlFormatter(nowrap=True))
+    return split_lines(html)
+
+
+def join_lines(lines):
+    '''Joins the lines returned by :func:`render_lines`, to be stored.'''
+    return ''.join(line + '\n' for line in lines)
+
+
+def split_lines(html):
+    '''Splits the lines joined by :func:`join_lines`.'''
+    return html.split('\n')[:-1]
+
+
+class WindowFormatter(HtmlFormatter):
+    '''Formats a range of lines highlighted by :func:`render_lines`.'''
+
+    def __init__(self, lines, **options):
+        HtmlFormatter.__init__(self, **options)
+        self.lines = lines
+
+    def _format_lines(self, tokensource):
+        for line in self.lines:
+            yield 1, line + '\n'
+
+
+def render_window(lines, start, style, linenos):
+    '''Renders the highlighted ``lines``, the first one being the line
+    ``start`` of the paste, like :func:`render` does for whole pastes.'''
+    formatter = WindowFormatter(lines, linenos=linenos,
+                                anchorlinenos=linenos, style=style,
+                                lineanchors='op', cssclass='syntax',
+                                linenostart=start)
+    rv = io.StringIO()
+    formatter.format(iter(()), rv)
+    return rv.getvalue()
+
+
+class HighlightCache(object):
+    '''Two-tier cache for rendered pastes.
+
+    The first tier is a bounded in-process LRU, sized by the
+    ``HIGHLIGHT_CACHE_SIZE`` configuration parameter. The second tier is
+    optional and stores one file per rendered paste in the directory set in
+    ``HIGHLIGHT_CACHE_DIR``, that may be shared by all the workers.
+
+    Keys are built from the paste id, the content hash, the language and the
+    Pygments settings, then a stale entry is never returned, but entries
+    should be invalidated when a paste changes, to release the space.
+
+    Entries may also be lists of highlighted lines, returned by
+    :func:`render_lines`. They are kept as lists in memory, then windows of
+    lines are sliced without splitting the whole paste again.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key(self, paste_id, content_hash, language, style, linenos):
+        digest = sha1(':'.join([content_hash, language or '', style,
+                                str(bool(linenos))]).encode('utf-8'))
+        return '%s-%s' % (paste_id, digest.hexdigest())
+
+    def _path(self, key):
+        cache_dir = current_app.config['HIGHLIGHT_CACHE_DIR']
+        if cache_dir is None:
+            return None
+        return os.path.join(cache_dir, '%s.html' % key)
+
+    def get(self, key, lines=False):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+
+        path = self._path(key)
+        if path is not None:
+            try:
+                with open(path, 'r', encoding='utf-8') as fp:
+                    html = fp.read()
+            except (IOError, OSError):
+                pass
+            else:
+                if lines:
+                    html = split_lines(html)
+                self._store(key, html)
+                with self.lock:
+                    self.disk_hits += 1
+                return html
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def _store(self, key, html):
+        size = int(current_app.config['HIGHLIGHT_CACHE_SIZE'])
+        if size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = html
+            self.entries.move_to_end(key)
+            while len(self.entries) > size:
+                self.entries.popitem(last=False)
+
+    def set(self, key, html):
+        self._store(key, html)
+        path = self._path(key)
+        if path is None:
+            return
+
+        # write to a temporary file and rename it, then other workers never
+        # read a partial file.
+        try:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path),
+                                       suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as fp:
+                fp.write(html if isinstance(html, str) else join_lines(html))
+            os.replace(tmp, path)
+        except (IOError, OSError):
+            current_app.logger.warning('Failed to write highlight cache '
+                                       'file: %s', path)
+
+    def invalidate(self, paste_id):
+        if paste_id is None:
+            return
+        prefix = '%s-' % paste_id
+        with self.lock:
+            for key in [i for i in self.entries if i.startswith(prefix)]:
+                del self.entries[key]
+
+        cache_dir = current_app.config['HIGHLIGHT_CACHE_DIR']
+        if cache_dir is None:
+            return
+        for path in glob.glob(os.path.join(cache_dir, '%s*.html' % prefix)):
+            try:
+                os.unlink(path)
+            except (IOError, OSError):
+                pass
+
+    def stats(self):
+        with self.lock:
+            return dict(hits=self.hits, disk_hits=self.disk_hits,
+                        misses=self.misses, size=len(self.entries))
+
+
+cache = HighlightCache()
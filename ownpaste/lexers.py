@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+    ownpaste.lexers
+    ~~~~~~~~~~~~~~~
+
+    Module with the language detection for pastes.
+
+    Languages are detected in tiers, from the cheapest to the most expensive:
+
+    1. the file name is looked up in an index built from the lexer patterns;
+    2. the shebang and vim/emacs modelines are sniffed;
+    3. the ``analyse_text`` method of every lexer is run over a bounded sample
+       of the content, until a time budget runs out.
+
+    :copyright: (c) 2012-2013 by Rafael Goncalves Martins
+    :license: BSD, see LICENSE for more details.
+"""
+
+from fnmatch import fnmatch
+from pygments.lexers import find_lexer_class_by_name, get_all_lexers
+from pygments.modeline import get_filetype_from_buffer
+from pygments.util import ClassNotFound
+
+import os
+import re
+import threading
+import time
+
+# interpreters whose name isn't an alias of their lexer
+INTERPRETERS = {
+    'node': 'javascript',
+    'nodejs': 'javascript',
+    'python2': 'python2',
+    'runghc': 'haskell',
+    'rscript': 'r',
+}
+
+re_shebang = re.compile(r'^#!\s*(\S+)(.*)$')
+re_emacs = re.compile(r'-\*-\s*(?:.*?mode:\s*)?([\w+-]+)\s*;?.*?-\*-',
+                      re.IGNORECASE)
+
+
+class LexerIndex(object):
+
+    def __init__(self):
+        self.aliases = {}
+        self.extensions = {}
+        self.filenames = {}
+        self.patterns = []
+        self.lexers = []
+        self.classes = {}
+        for name, aliases, filenames, mimetypes in get_all_lexers():
+            if not aliases:
+                continue
+            alias = aliases[0]
+            for i in aliases:
+                self.aliases.setdefault(i.lower(), alias)
+            for pattern in filenames:
+                if not any(c in pattern for c in '*?['):
+                    self.filenames.setdefault(pattern, []).append(alias)
+                elif pattern.startswith('*.') and \
+                        not any(c in pattern[2:] for c in '*?['):
+                    self.extensions.setdefault(pattern[1:], []).append(alias)
+                else:
+                    self.patterns.append((pattern, alias))
+            self.lexers.append(alias)
+
+    def lexer_class(self, alias):
+        if alias not in self.classes:
+            try:
+                self.classes[alias] = find_lexer_class_by_name(alias)
+            except ClassNotFound:
+                self.classes[alias] = None
+        return self.classes[alias]
+
+    def by_file_name(self, file_name):
+        base_name = os.path.basename(file_name)
+        rv = list(self.filenames.get(base_name, []))
+        i = base_name.find('.')
+        while i != -1:
+            rv.extend(self.extensions.get(base_name[i:], []))
+            i = base_name.find('.', i + 1)
+        for pattern, alias in self.patterns:
+            if fnmatch(base_name, pattern):
+                rv.append(alias)
+        return sorted(set(rv))
+
+    def by_name(self, name):
+        name = name.lower()
+        alias = INTERPRETERS.get(name) or self.aliases.get(name)
+        if alias is None:
+            # python3.11 -> python3 -> python
+            alias = self.aliases.get(name.rstrip('0123456789.'))
+        return alias
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = LexerIndex()
+    return _index
+
+
+def sniff_shebang(file_content):
+    first_line = file_content[:256].split('\n', 1)[0]
+    match = re_shebang.match(first_line)
+    if match is None:
+        return None
+    interpreter = os.path.basename(match.group(1))
+    if interpreter == 'env':
+        args = [i for i in match.group(2).split() if not i.startswith('-')]
+        if not args:
+            return None
+        interpreter = args[0]
+    return get_index().by_name(interpreter)
+
+
+def sniff_modeline(file_content):
+    index = get_index()
+    filetype = get_filetype_from_buffer(file_content)
+    if filetype is not None:
+        alias = index.by_name(filetype)
+        if alias is not None:
+            return alias
+    for line in file_content[:512].split('\n', 2)[:2]:
+        match = re_emacs.search(line)
+        if match is not None:
+            alias = index.by_name(match.group(1))
+            if alias is not None:
+                return alias
+    return None
+
+
+def analyse(sample, aliases, deadline=None):
+    index = get_index()
+    best_rating = 0.0
+    best = None
+    for alias in aliases:
+        if deadline is not None and time.monotonic() > deadline:
+            break
+        lexer = index.lexer_class(alias)
+        if lexer is None:
+            continue
+        try:
+            rating = lexer.analyse_text(sample)
+        except Exception:
+            continue
+        if rating == 1.0:
+            return alias
+        if rating > best_rating:
+            best_rating = rating
+            best = alias
+    return best
+
+
+def guess_language(file_content, file_name=None, sample_size=16384,
+                   timeout=0.2):
+    '''Returns the alias of the lexer that best fits the given paste.
+
+    Only the first ``sample_size`` characters of the content are analysed,
+    and the analysis stops after ``timeout`` seconds, returning the best
+    rated lexer found so far.
+    '''
+    index = get_index()
+    sample = file_content[:sample_size]
+
+    if file_name is not None:
+        candidates = index.by_file_name(file_name)
+        if len(candidates) == 1:
+            return candidates[0]
+        if candidates:
+            return analyse(sample, candidates) or candidates[0]
+
+    alias = sniff_shebang(sample) or sniff_modeline(sample)
+    if alias is not None:
+        return alias
+
+    deadline = None
+    if timeout is not None:
+        deadline = time.monotonic() + timeout
+    alias = analyse(sample, index.lexers, deadline)
+    if alias is None:
+        return 'text'
+
+    # a lexer guessed from the content must be ok for the file name
+    if file_name is not None:
+        lexer = index.lexer_class(alias)
+        if lexer is not None and lexer.filenames:
+            return 'text'
+    return alias
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+    ownpaste.metrics
+    ~~~~~~~~~~~~~~~~
+
+    Module with the request instrumentation.
+
+    The time spent in each phase of a request (database queries, language
+    guessing, syntax highlighting, content negotiation, template rendering
+    and authentication) is sent to the client in a ``Server-Timing`` header,
+    and aggregated in histograms and counters, served in the Prometheus text
+    format by the ``/metrics`` endpoint. Phases may nest, e.g. highlighting
+    usually happens while rendering the template.
+
+    Metrics are kept in the process memory, then each worker process exports
+    its own values.
+
+    :copyright: (c) 2012-2013 by Rafael Goncalves Martins
+    :license: BSD, see LICENSE for more details.
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from flask import current_app, g, has_request_context, request
+from ownpaste.highlight import cache as highlight_cache
+
+import threading
+import time
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"') \
+        .replace('\n', r'\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value))
+                             for name, value in pairs)
+
+
+class Metric(object):
+
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+
+    def samples(self):
+        '''Returns the ``(name, labels, value)`` samples of the metric.'''
+        raise NotImplementedError
+
+    def expose(self):
+        lines = ['# HELP %s %s' % (self.name, self.help),
+                 '# TYPE %s %s' % (self.name, self.type)]
+        for name, labels, value in self.samples():
+            if isinstance(value, float):
+                value = repr(value)
+            lines.append('%s%s %s' % (name, labels, value))
+        return lines
+
+
+class Counter(Metric):
+
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        Metric.__init__(self, name, help, labelnames)
+        self.values = {}
+        if not self.labelnames:
+            self.values[()] = 0
+
+    def inc(self, *labels):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + 1
+
+    def samples(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        return [(self.name, _labels(self.labelnames, labels), value)
+                for labels, value in values]
+
+
+class Histogram(Metric):
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=BUCKETS):
+        Metric.__init__(self, name, help, labelnames)
+        self.buckets = buckets
+        self.values = {}  # labels -> [bucket counts, sum, count]
+
+    def observe(self, value, *labels):
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * len(self.buckets), 0.0,
+                                               0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self.lock:
+            values = sorted((labels, (list(counts), total, count))
+                            for labels, (counts, total, count)
+                            in self.values.items())
+        rv = []
+        for labels, (counts, total, count) in values:
+            for bound, bucket in zip(self.buckets, counts):
+                rv.append((self.name + '_bucket',
+                           _labels(self.labelnames, labels,
+                                   [('le', repr(bound))]), bucket))
+            rv.append((self.name + '_bucket',
+                       _labels(self.labelnames, labels, [('le', '+Inf')]),
+                       count))
+            rv.append((self.name + '_sum', _labels(self.labelnames, labels),
+                       total))
+            rv.append((self.name + '_count',
+                       _labels(self.labelnames, labels), count))
+        return rv
+
+
+class HighlightCacheCollector(Metric):
+    '''Exports the statistics of the rendered HTML cache.'''
+
+    type = 'counter'
+
+    def __init__(self):
+        Metric.__init__(self, 'ownpaste_highlight_cache_requests_total',
+                        'Lookups in the rendered HTML cache, by result.',
+                        ('result',))
+
+    def samples(self):
+        stats = highlight_cache.stats()
+        return [(self.name, _labels(self.labelnames, (result,)),
+                 stats[key]) for result, key in (('hit', 'hits'),
+                                                 ('disk_hit', 'disk_hits'),
+                                                 ('miss', 'misses'))]
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def expose(self):
+        '''Returns all the metrics, in the Prometheus text format.'''
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+request_duration = registry.register(Histogram(
+    'ownpaste_request_duration_seconds',
+    'Time spent handling requests, by endpoint.', ('endpoint',)))
+phase_duration = registry.register(Histogram(
+    'ownpaste_phase_duration_seconds',
+    'Time spent in each phase of the requests.', ('phase',)))
+auth_failures = registry.register(Counter(
+    'ownpaste_auth_failures_total',
+    'Failed authentications, by method.', ('method',)))
+auth_blocks = registry.register(Counter(
+    'ownpaste_auth_blocked_ips_total',
+    'Ips blocked after too many failed authentications.'))
+auth_blocked_requests = registry.register(Counter(
+    'ownpaste_auth_blocked_requests_total',
+    'Requests rejected because the ip is blocked.'))
+registry.register(HighlightCacheCollector())
+
+
+def observe(phase, duration):
+    '''Records the duration of a phase, adding it to the timings of the
+    current request, if any.'''
+    phase_duration.observe(duration, phase)
+    if has_request_context():
+        timings = g.setdefault('timings', OrderedDict())
+        timings[phase] = timings.get(phase, 0.0) + duration
+
+
+@contextmanager
+def timed(phase):
+    '''Context manager (or decorator) that records the time spent in a
+    phase.'''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(phase, time.perf_counter() - start)
+
+
+def server_timing(timings, total):
+    entries = ['%s;dur=%.3f' % (phase, duration * 1000)
+               for phase, duration in timings.items()]
+    entries.append('total;dur=%.3f' % (total * 1000))
+    return ', '.join(entries)
+
+
+def init_app(app):
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def stop_timer(response):
+        start = g.get('request_start')
+        if start is None:
+            return response
+        total = time.perf_counter() - start
+        endpoint = request.url_rule is not None and \
+            request.url_rule.endpoint or 'none'
+        request_duration.observe(total, endpoint)
+        if current_app.config['SERVER_TIMING']:
+            response.headers['Server-Timing'] = \
+                server_timing(g.get('timings', {}), total)
+        return response
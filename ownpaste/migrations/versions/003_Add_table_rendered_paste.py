@@ -0,0 +1,31 @@
+from sqlalchemy import MetaData, Table, Column, Integer, String, Text, \
+     ForeignKey
+
+
+pre_meta = MetaData()
+post_meta = MetaData()
+paste = Table('paste', post_meta,
+    Column('paste_id', Integer, primary_key=True, nullable=False),
+)
+
+rendered_paste = Table('rendered_paste', post_meta,
+    Column('rendered_id', Integer, primary_key=True, nullable=False),
+    Column('paste_id', Integer, ForeignKey('paste.paste_id'), index=True),
+    Column('render_key', String(length=100), unique=True),
+    Column('html', Text),
+)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['rendered_paste'].create()
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['rendered_paste'].drop()
@@ -0,0 +1,74 @@
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, \
+     Text, Index, select
+
+
+pre_meta = MetaData()
+post_meta = MetaData()
+paste = Table('paste', post_meta,
+    Column('paste_id', Integer, primary_key=True, nullable=False),
+    Column('private_id', String(length=40)),
+    Column('language', String(length=30)),
+    Column('file_name', Text),
+    Column('file_content', Text),
+    Column('pub_date', DateTime),
+    Column('preview', Text),
+    Column('size_bytes', Integer),
+    Column('line_count', Integer),
+    Index('ix_paste_private_id_paste_id', 'private_id', 'paste_id'),
+)
+
+BATCH_SIZE = 500
+
+
+def split_lines(text):
+    # lines are split as Pygments does, only on the line endings, not on the
+    # other unicode line boundaries.
+    if u'\r' in text:
+        text = text.replace(u'\r\n', u'\n').replace(u'\r', u'\n')
+    lines = text.split(u'\n')
+    if lines[-1] == u'':
+        lines.pop()
+    return lines
+
+
+def backfill(migrate_engine):
+    last_id = 0
+    while 1:
+        rows = migrate_engine.execute(
+            select([paste.c.paste_id, paste.c.file_content])
+            .where(paste.c.paste_id > last_id)
+            .order_by(paste.c.paste_id)
+            .limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        with migrate_engine.begin() as conn:
+            for paste_id, file_content in rows:
+                file_content = file_content or u''
+                lines = split_lines(file_content)
+                conn.execute(paste.update()
+                             .where(paste.c.paste_id == paste_id)
+                             .values(preview=u'\n'.join(lines[:5]),
+                                     size_bytes=len(
+                                         file_content.encode('utf-8')),
+                                     line_count=len(lines)))
+        last_id = rows[-1][0]
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['paste'].columns['preview'].create()
+    post_meta.tables['paste'].columns['size_bytes'].create()
+    post_meta.tables['paste'].columns['line_count'].create()
+    backfill(migrate_engine)
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['paste'].columns['line_count'].drop()
+    post_meta.tables['paste'].columns['size_bytes'].drop()
+    post_meta.tables['paste'].columns['preview'].drop()
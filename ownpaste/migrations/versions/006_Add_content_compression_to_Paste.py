@@ -0,0 +1,39 @@
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, \
+     Text, LargeBinary, Index
+
+
+pre_meta = MetaData()
+post_meta = MetaData()
+paste = Table('paste', post_meta,
+    Column('paste_id', Integer, primary_key=True, nullable=False),
+    Column('private_id', String(length=40)),
+    Column('language', String(length=30)),
+    Column('file_name', Text),
+    Column('file_content', Text),
+    Column('pub_date', DateTime),
+    Column('preview', Text),
+    Column('size_bytes', Integer),
+    Column('line_count', Integer),
+    Column('content_codec', String(length=10)),
+    Column('content_data', LargeBinary),
+    Index('ix_paste_private_id_paste_id', 'private_id', 'paste_id'),
+)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['paste'].columns['content_codec'].create()
+    post_meta.tables['paste'].columns['content_data'].create()
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    # compressed pastes must be decompressed with the recompress command
+    # before downgrading.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['paste'].columns['content_data'].drop()
+    post_meta.tables['paste'].columns['content_codec'].drop()
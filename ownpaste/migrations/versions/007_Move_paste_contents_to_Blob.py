@@ -0,0 +1,161 @@
+from hashlib import sha256
+from migrate.changeset.constraint import ForeignKeyConstraint
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, \
+     Text, LargeBinary, ForeignKey, Index, select
+
+import gzip
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+pre_meta = MetaData()
+post_meta = MetaData()
+pre_blob = Table('blob', pre_meta,
+    Column('blob_id', Integer, primary_key=True, nullable=False),
+    Column('content_hash', String(length=64), unique=True),
+    Column('refcount', Integer),
+    Column('codec', String(length=10)),
+    Column('data', LargeBinary),
+)
+
+pre_paste = Table('paste', pre_meta,
+    Column('paste_id', Integer, primary_key=True, nullable=False),
+    Column('private_id', String(length=40)),
+    Column('language', String(length=30)),
+    Column('file_name', Text),
+    Column('file_content', Text),
+    Column('pub_date', DateTime),
+    Column('preview', Text),
+    Column('size_bytes', Integer),
+    Column('line_count', Integer),
+    Column('content_codec', String(length=10)),
+    Column('content_data', LargeBinary),
+    Column('blob_id', Integer),
+    Index('ix_paste_private_id_paste_id', 'private_id', 'paste_id'),
+)
+
+blob = Table('blob', post_meta,
+    Column('blob_id', Integer, primary_key=True, nullable=False),
+    Column('content_hash', String(length=64), unique=True),
+    Column('refcount', Integer),
+    Column('codec', String(length=10)),
+    Column('data', LargeBinary),
+)
+
+paste = Table('paste', post_meta,
+    Column('paste_id', Integer, primary_key=True, nullable=False),
+    Column('private_id', String(length=40)),
+    Column('language', String(length=30)),
+    Column('file_name', Text),
+    Column('blob_id', Integer, ForeignKey('blob.blob_id')),
+    Column('pub_date', DateTime),
+    Column('preview', Text),
+    Column('size_bytes', Integer),
+    Column('line_count', Integer),
+    Index('ix_paste_private_id_paste_id', 'private_id', 'paste_id'),
+    Index('ix_paste_blob_id', 'blob_id'),
+)
+
+BATCH_SIZE = 500
+
+
+def decompress(codec, data):
+    if codec == 'gzip':
+        return gzip.decompress(data)
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError('Unsupported compression codec: %s' % codec)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    pre_meta.tables['blob'].create()
+    pre_meta.tables['paste'].columns['blob_id'].create()
+
+    # move the contents to the blob table, one blob per distinct content
+    last_id = 0
+    while 1:
+        rows = migrate_engine.execute(
+            select([pre_paste.c.paste_id, pre_paste.c.file_content,
+                    pre_paste.c.content_codec, pre_paste.c.content_data])
+            .where(pre_paste.c.paste_id > last_id)
+            .order_by(pre_paste.c.paste_id)
+            .limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        with migrate_engine.begin() as conn:
+            for paste_id, file_content, codec, data in rows:
+                if codec is None:
+                    data = (file_content or u'').encode('utf-8')
+                    content = data
+                else:
+                    content = decompress(codec, data)
+                content_hash = sha256(content).hexdigest()
+                row = conn.execute(
+                    select([pre_blob.c.blob_id])
+                    .where(pre_blob.c.content_hash == content_hash)
+                    ).fetchone()
+                if row is None:
+                    blob_id = conn.execute(pre_blob.insert().values(
+                        content_hash=content_hash, refcount=1, codec=codec,
+                        data=data)).inserted_primary_key[0]
+                else:
+                    blob_id = row[0]
+                    conn.execute(pre_blob.update()
+                                 .where(pre_blob.c.blob_id == blob_id)
+                                 .values(refcount=pre_blob.c.refcount + 1))
+                conn.execute(pre_paste.update()
+                             .where(pre_paste.c.paste_id == paste_id)
+                             .values(blob_id=blob_id))
+        last_id = rows[-1][0]
+
+    pre_meta.tables['paste'].columns['content_data'].drop()
+    pre_meta.tables['paste'].columns['content_codec'].drop()
+    pre_meta.tables['paste'].columns['file_content'].drop()
+    Index('ix_paste_blob_id', pre_paste.c.blob_id).create()
+
+    # sqlite can't add constraints to existing tables, and doesn't enforce
+    # foreign keys by default
+    if migrate_engine.name != 'sqlite':
+        ForeignKeyConstraint([pre_paste.c.blob_id],
+                             [pre_blob.c.blob_id]).create()
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    pre_meta.tables['paste'].columns['file_content'].create()
+    pre_meta.tables['paste'].columns['content_codec'].create()
+    pre_meta.tables['paste'].columns['content_data'].create()
+
+    last_id = 0
+    while 1:
+        rows = migrate_engine.execute(
+            select([paste.c.paste_id, blob.c.codec, blob.c.data])
+            .select_from(paste.join(blob))
+            .where(paste.c.paste_id > last_id)
+            .order_by(paste.c.paste_id)
+            .limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        with migrate_engine.begin() as conn:
+            for paste_id, codec, data in rows:
+                if codec is None:
+                    values = dict(file_content=data.decode('utf-8'))
+                else:
+                    values = dict(content_codec=codec, content_data=data)
+                conn.execute(pre_paste.update()
+                             .where(pre_paste.c.paste_id == paste_id)
+                             .values(**values))
+        last_id = rows[-1][0]
+
+    Index('ix_paste_blob_id', pre_paste.c.blob_id).drop()
+    pre_meta.tables['paste'].columns['blob_id'].drop()
+    post_meta.tables['blob'].drop()
@@ -0,0 +1,26 @@
+from sqlalchemy import text
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+
+    # the index is populated by the reindex command
+    if migrate_engine.name == 'sqlite':
+        migrate_engine.execute(text(
+            'CREATE VIRTUAL TABLE paste_search USING '
+            'fts5(file_name, file_content)'))
+    elif migrate_engine.name == 'postgresql':
+        migrate_engine.execute(text(
+            'CREATE TABLE paste_search ('
+            'paste_id INTEGER PRIMARY KEY REFERENCES paste (paste_id) '
+            'ON DELETE CASCADE, document TSVECTOR NOT NULL)'))
+        migrate_engine.execute(text(
+            'CREATE INDEX ix_paste_search_document ON paste_search '
+            'USING GIN (document)'))
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    if migrate_engine.name in ('sqlite', 'postgresql'):
+        migrate_engine.execute(text('DROP TABLE paste_search'))
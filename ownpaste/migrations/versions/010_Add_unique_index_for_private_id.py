@@ -0,0 +1,27 @@
+from sqlalchemy import MetaData, Table, Column, Integer, String, Index
+
+
+pre_meta = MetaData()
+post_meta = MetaData()
+paste = Table('paste', post_meta,
+    Column('paste_id', Integer, primary_key=True, nullable=False),
+    Column('private_id', String(length=40)),
+)
+
+ix_paste_private_id = Index('ix_paste_private_id', paste.c.private_id,
+                            unique=True)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    ix_paste_private_id.create()
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    ix_paste_private_id.drop()
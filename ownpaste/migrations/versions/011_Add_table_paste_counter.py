@@ -0,0 +1,40 @@
+from sqlalchemy import MetaData, Table, Column, Integer, String, func, \
+     select
+
+
+pre_meta = MetaData()
+post_meta = MetaData()
+paste = Table('paste', post_meta,
+    Column('paste_id', Integer, primary_key=True, nullable=False),
+    Column('private_id', String(length=40)),
+)
+
+paste_counter = Table('paste_counter', post_meta,
+    Column('name', String(length=30), primary_key=True, nullable=False),
+    Column('value', Integer, nullable=False),
+)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['paste_counter'].create()
+
+    # count the existing pastes
+    count = select([func.count()]).select_from(paste)
+    total = migrate_engine.execute(count).scalar()
+    public = migrate_engine.execute(
+        count.where(paste.c.private_id == None)).scalar()
+    migrate_engine.execute(paste_counter.insert(), [
+        dict(name='total', value=total),
+        dict(name='public', value=public),
+    ])
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['paste_counter'].drop()
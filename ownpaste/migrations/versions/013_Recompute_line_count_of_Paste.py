@@ -0,0 +1,99 @@
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, \
+     Text, LargeBinary, Index, select
+
+import gzip
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+pre_meta = MetaData()
+post_meta = MetaData()
+blob = Table('blob', post_meta,
+    Column('blob_id', Integer, primary_key=True, nullable=False),
+    Column('content_hash', String(length=64), unique=True),
+    Column('refcount', Integer),
+    Column('codec', String(length=10)),
+    Column('data', LargeBinary),
+)
+
+paste = Table('paste', post_meta,
+    Column('paste_id', Integer, primary_key=True, nullable=False),
+    Column('private_id', String(length=40)),
+    Column('language', String(length=30)),
+    Column('file_name', Text),
+    Column('pub_date', DateTime),
+    Column('preview', Text),
+    Column('size_bytes', Integer),
+    Column('line_count', Integer),
+    Column('blob_id', Integer),
+    Column('updated_at', DateTime),
+    Column('expires_at', DateTime),
+    Index('ix_paste_private_id', 'private_id', unique=True),
+    Index('ix_paste_private_id_paste_id', 'private_id', 'paste_id'),
+    Index('ix_paste_blob_id', 'blob_id'),
+    Index('ix_paste_expires_at', 'expires_at'),
+)
+
+BATCH_SIZE = 500
+
+
+def decompress(codec, data):
+    if codec == 'gzip':
+        return gzip.decompress(data)
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError('Unsupported compression codec: %s' % codec)
+
+
+def split_lines(text):
+    # lines are split as Pygments does, only on the line endings, not on the
+    # other unicode line boundaries.
+    if u'\r' in text:
+        text = text.replace(u'\r\n', u'\n').replace(u'\r', u'\n')
+    lines = text.split(u'\n')
+    if lines[-1] == u'':
+        lines.pop()
+    return lines
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+
+    # the listing metadata was computed with str.splitlines(), that also
+    # splits on form feeds and other unicode line boundaries.
+    last_id = 0
+    while 1:
+        rows = migrate_engine.execute(
+            select([paste.c.paste_id, paste.c.preview, paste.c.line_count,
+                    blob.c.codec, blob.c.data])
+            .select_from(paste.join(blob, paste.c.blob_id == blob.c.blob_id))
+            .where(paste.c.paste_id > last_id)
+            .order_by(paste.c.paste_id)
+            .limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        with migrate_engine.begin() as conn:
+            for paste_id, preview, line_count, codec, data in rows:
+                data = data or b''
+                if codec is not None:
+                    data = decompress(codec, data)
+                lines = split_lines(data.decode('utf-8'))
+                values = dict(preview=u'\n'.join(lines[:5]),
+                              line_count=len(lines))
+                if values != dict(preview=preview, line_count=line_count):
+                    conn.execute(paste.update()
+                                 .where(paste.c.paste_id == paste_id)
+                                 .values(**values))
+        last_id = rows[-1][0]
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    # the recomputed values are valid for older versions too.
+    pass
@@ -9,29 +9,203 @@
     :license: BSD, see LICENSE for more details.
 """
 
+from collections import deque
+from contextlib import contextmanager
 from datetime import datetime
 from flask import current_app
-from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 from jinja2 import Markup
-from fnmatch import fnmatch
-from pygments import highlight
-from pygments.formatters import HtmlFormatter
-from pygments.lexers import TextLexer, get_lexer_by_name, guess_lexer, \
-     guess_lexer_for_filename
+from hashlib import sha1, sha256
+from ownpaste.compression import compress, decompress, decompress_chunks
+from ownpaste.highlight import cache as highlight_cache, render, \
+     render_lines, render_window, split_lines
+from ownpaste.lexers import guess_language
+from ownpaste.metrics import observe, timed
+from pygments.lexers import TextLexer, get_lexer_by_name
 from pytz import timezone, utc
-
-import random
+from sqlalchemy import event, inspect, orm
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool, QueuePool
+from sqlalchemy.sql.expression import Select
+
+import calendar
+import os
+import secrets
+import sqlite3
 import string
+import threading
 import time
 
-db = SQLAlchemy()
 
+def _sqlite_pragmas(pragmas):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute('PRAGMA %s = %s' % (name, value))
+        finally:
+            cursor.close()
+    return set_pragmas
+
+
+class RoutingSession(SignallingSession):
+    '''Session that runs the queries of :func:`reading` blocks on the
+    ``read`` bind, if configured in ``SQLALCHEMY_BINDS``. Flushes and any
+    other statements always use the primary database.'''
+
+    def __init__(self, db, **options):
+        self.db = db
+        SignallingSession.__init__(self, db, **options)
+
+    def read_bind(self):
+        '''Returns the engine of the ``read`` bind, if the session is in a
+        :func:`reading` block and the bind is configured, or None.'''
+        if self.info.get('reading') and \
+           'read' in (self.app.config['SQLALCHEMY_BINDS'] or ()):
+            return self.db.get_engine(self.app, bind='read')
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and isinstance(clause, Select):
+            bind = self.read_bind()
+            if bind is not None:
+                return bind
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class Database(SQLAlchemy):
+    '''Flask-SQLAlchemy extension tuned for ownpaste.
+
+    Connections to SQLite databases are kept in a pool of
+    ``SQLITE_POOL_SIZE`` connections, and set up with the ``SQLITE_PRAGMAS``
+    when opened: by default, write-ahead logging, that lets readers run
+    concurrently with a writer, and a busy timeout, that makes writers wait
+    for each other instead of failing with "database is locked".
+    '''
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        sa_url, options = SQLAlchemy.apply_driver_hacks(self, app, sa_url,
+                                                        options)
+        if sa_url.drivername == 'sqlite':
+            options['sqlite_pragmas'] = app.config['SQLITE_PRAGMAS']
+
+            # the pool is only replaced for file databases, memory databases
+            # use a single connection.
+            pool_size = int(app.config['SQLITE_POOL_SIZE'])
+            if options.get('poolclass') is NullPool and pool_size:
+                options['poolclass'] = QueuePool
+                options['pool_size'] = pool_size
+                options.setdefault('connect_args', {})
+                options['connect_args']['check_same_thread'] = False
+        return sa_url, options
+
+    def create_engine(self, sa_url, engine_opts):
+        pragmas = engine_opts.pop('sqlite_pragmas', None)
+        engine = SQLAlchemy.create_engine(self, sa_url, engine_opts)
+        if pragmas:
+            event.listen(engine, 'connect', _sqlite_pragmas(pragmas))
+        return engine
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = Database()
+
+
+@contextmanager
+def reading():
+    '''Context manager (or decorator) that runs the queries of the block on
+    the ``read`` bind, if configured. The block must not write to the
+    database, or its reads may not see the writes.'''
+    info = db.session.info
+    previous = info.get('reading', False)
+    info['reading'] = True
+    try:
+        yield
+    finally:
+        info['reading'] = previous
+
+
+def read_engine():
+    '''Returns the engine used by the queries of the current session.'''
+    return db.session().read_bind() or db.engine
+
+
+# the time spent running queries is recorded as the 'db' phase of requests
+@event.listens_for(Engine, 'before_cursor_execute')
+def _query_started(conn, cursor, statement, parameters, context,
+                   executemany):
+    context.ownpaste_query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _query_finished(conn, cursor, statement, parameters, context,
+                    executemany):
+    observe('db', time.perf_counter() - context.ownpaste_query_start)
+
+
+class PrivateIdPool(object):
+    '''Pool of random private ids.
+
+    Ids are built from the operating system CSPRNG, with about 119 bits of
+    entropy, then collisions are unlikely enough to rely on the unique index
+    of ``private_id`` instead of querying the database before using an id.
+    The random bytes are read in batches of ``PRIVATE_ID_POOL_SIZE`` ids (or
+    one id at a time, if 0).
+    '''
+
+    chars = string.ascii_letters + string.digits
+    length = 20
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = deque()
+
+        # forked processes must not reuse the ids of their parent
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self.ids.clear)
+
+    def generate(self, count):
+        rv = []
+        while len(rv) < count:
+            # bytes above the largest multiple of the number of chars are
+            # discarded, otherwise the first chars would be more likely
+            limit = 256 - 256 % len(self.chars)
+            data = [b for b in secrets.token_bytes(
+                (count - len(rv)) * self.length * 9 // 8 + self.length)
+                if b < limit]
+            for i in range(0, len(data) - self.length + 1, self.length):
+                private_id = ''.join(self.chars[b % len(self.chars)]
+                                     for b in data[i:i + self.length])
+
+                # all-digit ids would be taken as public paste ids
+                if not private_id.isdigit():
+                    rv.append(private_id)
+        return rv[:count]
+
+    def reserve(self, count):
+        '''Makes sure that the pool has at least ``count`` ids, e.g. before
+        creating many private pastes.'''
+        with self.lock:
+            if len(self.ids) < count:
+                self.ids.extend(self.generate(count - len(self.ids)))
+
+    def get(self):
+        with self.lock:
+            if not self.ids:
+                size = int(current_app.config['PRIVATE_ID_POOL_SIZE'])
+                if size <= 0:
+                    return self.generate(1)[0]
+                self.ids.extend(self.generate(size))
+            return self.ids.popleft()
+
+
+private_ids = PrivateIdPool()
 
-class Private(object):
 
-    def _random_id(self, length=20):
-        chars = string.ascii_letters + string.digits
-        return ''.join(random.choice(chars) for x in range(length))
+class Private(object):
 
     def __get__(self, obj, cls):
         return obj.private_id is not None
@@ -45,14 +219,30 @@ class Private(object):
         if obj.private_id is not None:
             return
 
-        # loop until find an unique id
-        while 1:
-            obj.private_id = self._random_id()
-            paste = Paste.query.filter(db.and_(
-                Paste.private_id == obj.private_id,
-                Paste.paste_id != obj.paste_id)).first()
-            if paste is None:
-                break
+        # collisions are detected by the unique index, when committing. see
+        # commit_pastes().
+        obj.private_id = private_ids.get()
+
+
+def commit_pastes(func, retries=3):
+    '''Calls ``func``, that adds or changes pastes in the session, and
+    commits the session, returning the result of ``func``.
+
+    If a new private id collides with an existing one, or a new blob was
+    created concurrently by another transaction, the transaction is rolled
+    back and ``func`` is called again, drawing new ids and reusing the blob.
+    '''
+    for i in range(retries):
+        try:
+            rv = func()
+            db.session.commit()
+            return rv
+        except IntegrityError as e:
+            db.session.rollback()
+            message = str(e.orig)
+            if i == retries - 1 or ('private_id' not in message and
+                                    'content_hash' not in message):
+                raise
 
 
 class Blocked(object):
@@ -73,70 +263,257 @@ class Blocked(object):
         obj.blocked_date = datetime.utcnow()
 
 
+class Blob(db.Model):
+    '''Content of pastes, stored once per distinct text.
+
+    Blobs are addressed by the SHA-256 of their content, and reference counted
+    by the pastes using them. The content is stored as UTF-8, compressed with
+    the codec in ``codec``, if any.
+    '''
+
+    blob_id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), unique=True)
+    refcount = db.Column(db.Integer)
+    codec = db.Column(db.String(10), nullable=True)
+    data = db.deferred(db.Column(db.LargeBinary))
+
+    def __init__(self, content_hash, data, codec=None):
+        self.content_hash = content_hash
+        self.refcount = 1
+        self.store(data, codec)
+
+    def store(self, data, codec=None):
+        min_size = int(current_app.config['CONTENT_COMPRESSION_MIN_SIZE'])
+        if codec is not None and len(data) >= min_size:
+            self.codec = codec
+            self.data = compress(codec, data)
+        else:
+            self.codec = None
+            self.data = data
+        self._content = data.decode('utf-8')
+
+    @property
+    def content(self):
+        # decode once per instance
+        rv = getattr(self, '_content', None)
+        if rv is None:
+            data = self.data
+            if self.codec is not None:
+                data = decompress(self.codec, data)
+            rv = data.decode('utf-8')
+            self._content = rv
+        return rv
+
+    def stream(self, chunk_size=65536, decompress=True):
+        '''Returns an iterator over the blob data, read from the database in
+        chunks. The iterator uses its own database connection, and can be
+        consumed after the end of the request.'''
+        chunks = self._read_chunks(read_engine(), self.blob_id, chunk_size)
+        if decompress and self.codec is not None:
+            chunks = decompress_chunks(self.codec, chunks, chunk_size)
+        return chunks
+
+    @classmethod
+    def _read_chunks(cls, engine, blob_id, chunk_size):
+        with engine.connect() as conn:
+            fairy = conn.connection
+            dbapi_conn = getattr(fairy, 'dbapi_connection', None) or \
+                fairy.connection
+
+            # sqlite incremental blob i/o, available since python 3.11
+            if isinstance(dbapi_conn, sqlite3.Connection) and \
+               hasattr(dbapi_conn, 'blobopen'):
+                with dbapi_conn.blobopen(cls.__tablename__, 'data', blob_id,
+                                         readonly=True) as blob:
+                    while 1:
+                        chunk = blob.read(chunk_size)
+                        if not chunk:
+                            break
+                        yield chunk
+                return
+
+            offset = 1
+            while 1:
+                chunk = conn.execute(
+                    db.select([db.func.substr(cls.__table__.c.data, offset,
+                                              chunk_size)])
+                    .where(cls.__table__.c.blob_id == blob_id)).scalar()
+                if not chunk:
+                    break
+                yield bytes(chunk)
+                offset += len(chunk)
+
+    @classmethod
+    def acquire(cls, fc):
+        data = fc.encode('utf-8')
+        content_hash = sha256(data).hexdigest()
+        blob = cls.query.filter(cls.content_hash == content_hash).first()
+        if blob is not None:
+            # the blob may be released by the last paste using it meanwhile.
+            # then it is created again.
+            if cls.query.filter(cls.blob_id == blob.blob_id,
+                                cls.refcount > 0).update(
+                    {cls.refcount: cls.refcount + 1},
+                    synchronize_session=False):
+                return blob
+            db.session.expunge(blob)
+
+        # concurrent requests may create the same blob. all but one fail
+        # with an integrity error, and are retried by commit_pastes(),
+        # reusing it.
+        blob = cls(content_hash, data,
+                   current_app.config['CONTENT_COMPRESSION'])
+        db.session.add(blob)
+        return blob
+
+    @classmethod
+    def release(cls, blob_id):
+        if blob_id is None:
+            return
+        cls.query.filter(cls.blob_id == blob_id).update(
+            {cls.refcount: cls.refcount - 1}, synchronize_session=False)
+        cls.query.filter(cls.blob_id == blob_id, cls.refcount <= 0).delete(
+            synchronize_session=False)
+
+    def __repr__(self):
+        return '<%s %s: refcount=%r>' % (self.__class__.__name__,
+                                         self.content_hash, self.refcount)
+
+
 class Paste(db.Model):
 
     paste_id = db.Column(db.Integer, primary_key=True)
-    private_id = db.Column(db.String(40), unique=True, nullable=True)
+    private_id = db.Column(db.String(40), nullable=True)
     language = db.Column(db.String(30))
     file_name = db.Column(db.Text, nullable=True)
-    file_content = db.Column(db.Text)
+    blob_id = db.Column(db.Integer, db.ForeignKey('blob.blob_id'),
+                        index=True)
+    preview = db.Column(db.Text)
+    size_bytes = db.Column(db.Integer)
+    line_count = db.Column(db.Integer)
     pub_date = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=True, index=True)
+    blob = db.relationship(Blob)
     private = Private()
 
+    __table_args__ = (db.Index('ix_paste_private_id', 'private_id',
+                               unique=True),
+                      db.Index('ix_paste_private_id_paste_id', 'private_id',
+                               'paste_id'))
+
     def __init__(self, file_content, file_name=None, language=None,
-                 private=False):
+                 private=False, expires_at=None):
         self.set_file_content(file_content)
         self.file_name = file_name
         self.language = language
         self.private = private
         self.pub_date = datetime.utcnow()
+        self.expires_at = expires_at
 
         # guess language, if needed
         if self.language is None:
-            if self.file_name is None:
-                lexer = guess_lexer(self.file_content)
-            else:
-                try:
-                    lexer = guess_lexer_for_filename(self.file_name,
-                                                     self.file_content)
-                except:
-                    lexer = guess_lexer(self.file_content)
-
-                # verify if lexer is ok for filename
-                found = False
-                for pattern in lexer.filenames:
-                    if fnmatch(self.file_name, pattern):
-                        found = True
-                        break
-                else:
-                    found = True
-                if not found:
-                    lexer = TextLexer
-            self.language = lexer.aliases[0]
+            with timed('guess'):
+                self.language = guess_language(
+                    self.file_content, self.file_name,
+                    current_app.config['LANGUAGE_GUESS_SAMPLE'],
+                    current_app.config['LANGUAGE_GUESS_TIMEOUT'])
 
     def set_file_content(self, fc):
-        self.file_content = fc
+        old_blob_id = self.blob_id
+        self.blob = Blob.acquire(fc)
+        if old_blob_id is not None:
+            # the paste must point to the new blob before releasing the old one
+            db.session.flush()
+            Blob.release(old_blob_id)
+        for key, value in self.content_metadata(fc).items():
+            setattr(self, key, value)
+        self.invalidate_rendered()
+
+    @staticmethod
+    def content_metadata(fc):
+        # listing metadata, stored to avoid loading the content. lines are
+        # split as Pygments does, only on the line endings, not on the other
+        # unicode line boundaries.
+        text = fc
+        if u'\r' in text:
+            text = text.replace(u'\r\n', u'\n').replace(u'\r', u'\n')
+        lines = text.split(u'\n')
+        if lines[-1] == u'':
+            lines.pop()
+        return dict(preview=u'\n'.join(lines[:5]),
+                    size_bytes=len(fc.encode('utf-8')),
+                    line_count=len(lines))
+
+    @property
+    def file_content(self):
+        return self.blob.content
+
+    def remove(self):
+        blob_id = self.blob_id
+        self.invalidate_rendered()
+        db.session.delete(self)
+        db.session.flush()
+        Blob.release(blob_id)
+
+    def invalidate_rendered(self):
+        if self.paste_id is None:
+            return
+        RenderedPaste.query.filter(
+            RenderedPaste.paste_id == self.paste_id).delete()
+        highlight_cache.invalidate(self.paste_id)
+
+    @staticmethod
+    def not_expired():
+        return db.or_(Paste.expires_at == None,
+                      Paste.expires_at > datetime.utcnow())
 
     @staticmethod
     def get(paste_id):
+        # the blob metadata is loaded with the paste, but not its content.
+        # expired pastes are gone, even if not removed yet.
+        query = Paste.query.options(db.joinedload(Paste.blob)) \
+            .filter(Paste.not_expired())
         if isinstance(paste_id, str) and not paste_id.isdigit():
-            return Paste.query.filter(
-                Paste.private_id == paste_id).first_or_404()
-        return Paste.query.filter(
-            Paste.paste_id == int(paste_id)).first_or_404()
+            return query.filter(Paste.private_id == paste_id).first_or_404()
+        return query.filter(Paste.paste_id == int(paste_id)).first_or_404()
 
     @staticmethod
-    def all(hide_private=True):
+    def all(hide_private=True, before=None):
         if hide_private:
             query = Paste.query.filter(Paste.private_id == None)
         else:
             query = Paste.query
+        query = query.filter(Paste.not_expired())
+        if before is not None:
+            query = query.filter(Paste.paste_id < before)
+
         return query.order_by(Paste.paste_id.desc())
 
+    @property
+    def last_modified(self):
+        return self.updated_at or self.pub_date
+
+    def etag(self, *args):
+        parts = [self.content_hash, str(self.paste_id), self.private_id or '',
+                 self.language or '', self.file_name or '',
+                 self.last_modified.isoformat(),
+                 current_app.config['PYGMENTS_STYLE'],
+                 str(bool(current_app.config['PYGMENTS_LINENOS'])),
+                 current_app.config['TIMEZONE']]
+        parts.extend(args)
+        return sha1(':'.join(parts).encode('utf-8')).hexdigest()
+
     @property
     def pub_timestamp(self):
         return int(time.mktime(self.pub_date.timetuple()))
 
+    @property
+    def expires_timestamp(self):
+        if self.expires_at is None:
+            return None
+        return calendar.timegm(self.expires_at.timetuple())
+
     @property
     def pub_date_localized(self):
         date_utc = utc.localize(self.pub_date)
@@ -157,23 +534,83 @@ class Paste(db.Model):
         except:
             return TextLexer
 
+    @property
+    def content_hash(self):
+        return self.blob.content_hash
+
+    @property
+    def render_key(self):
+        return highlight_cache.key(self.paste_id, self.content_hash,
+                                   self.language,
+                                   current_app.config['PYGMENTS_STYLE'],
+                                   current_app.config['PYGMENTS_LINENOS'])
+
+    @timed('highlight')
+    def render(self):
+        return render(self.file_content, self.lexer,
+                      current_app.config['PYGMENTS_STYLE'],
+                      current_app.config['PYGMENTS_LINENOS'])
+
     @property
     def file_content_highlighted(self):
-        linenos = current_app.config['PYGMENTS_LINENOS']
-        style = current_app.config['PYGMENTS_STYLE']
-        formatter = HtmlFormatter(linenos=linenos, anchorlinenos=linenos,
-                                  style=style, lineanchors='op',
-                                  cssclass='syntax')
-        return Markup('<div id="paste">%s</div>' % \
-                      highlight(self.file_content, self.lexer, formatter))
+        key = self.render_key
+        html = highlight_cache.get(key)
+        if html is None:
+
+            # use the html rendered by the background workers, if available,
+            # otherwise render it inline.
+            rendered = RenderedPaste.query.filter(
+                RenderedPaste.render_key == key).first()
+            if rendered is not None:
+                html = rendered.html
+            else:
+                html = self.render()
+            highlight_cache.set(key, html)
+        return Markup('<div id="paste">%s</div>' % html)
+
+    @property
+    def render_lines_key(self):
+        return '%s-lines' % self.render_key
+
+    @timed('highlight')
+    def render_lines(self):
+        return render_lines(self.file_content, self.lexer)
+
+    @property
+    def highlighted_lines(self):
+        '''List with the highlighted HTML of each line.'''
+        key = self.render_lines_key
+        lines = highlight_cache.get(key, lines=True)
+        if lines is None:
+
+            # use the lines rendered by the background workers, if
+            # available, otherwise render them inline.
+            rendered = RenderedPaste.query.filter(
+                RenderedPaste.render_key == key).first()
+            if rendered is not None:
+                lines = split_lines(rendered.html)
+            else:
+                lines = self.render_lines()
+            highlight_cache.set(key, lines)
+        return lines
+
+    def highlighted_window(self, start, end):
+        '''Returns the rendered HTML of the lines ``start`` to ``end``
+        (inclusive, starting from 1), and the number of highlighted lines.'''
+        lines = self.highlighted_lines
+        html = render_window(lines[start - 1:end], start,
+                             current_app.config['PYGMENTS_STYLE'],
+                             current_app.config['PYGMENTS_LINENOS'])
+        return Markup(html), len(lines)
 
     def to_json(self, short=False):
         rv = dict(paste_id=self.paste_id, language=self.language,
                   file_name=self.file_name, pub_timestamp=self.pub_timestamp,
-                  private=self.private, private_id=self.private_id)
+                  private=self.private, private_id=self.private_id,
+                  size_bytes=self.size_bytes, line_count=self.line_count,
+                  expires_timestamp=self.expires_timestamp)
         if short:
-            rv.update(file_content_preview=u'\n'.join(
-                self.file_content.splitlines()[:5]))
+            rv.update(file_content_preview=self.preview)
         else:
             rv.update(file_content=self.file_content)
         return rv
@@ -184,6 +621,108 @@ class Paste(db.Model):
                 self.language, self.private)
 
 
+class PasteCounter(db.Model):
+    '''Number of pastes, ``total`` and ``public``, kept up to date in the same
+    transaction as the changes to the pastes, then listings don't need to
+    count them.
+
+    Expired pastes are counted until they are removed, then they are
+    subtracted when reading the counters, using the index of ``expires_at``.
+    '''
+
+    name = db.Column(db.String(30), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+    names = ('total', 'public')
+
+    @classmethod
+    def get(cls, name):
+        '''Returns the number of pastes not expired of a counter, or None if
+        it is missing.'''
+        value = db.session.query(cls.value).filter(cls.name == name).scalar()
+        if value is None:
+            return None
+        return value - cls.expired(name)
+
+    @staticmethod
+    def expired(name):
+        '''Returns the number of expired pastes not removed yet, counted by a
+        counter.'''
+        query = db.session.query(db.func.count(Paste.paste_id)).filter(
+            Paste.expires_at <= datetime.utcnow())
+        if name == 'public':
+            query = query.filter(Paste.private_id == None)
+        return query.scalar()
+
+    @classmethod
+    def add(cls, connection, total=0, public=0):
+        for name, delta in (('total', total), ('public', public)):
+            if delta:
+                connection.execute(cls.__table__.update()
+                                   .where(cls.name == name)
+                                   .values(value=cls.value + delta))
+
+    @classmethod
+    def recount(cls):
+        '''Recomputes the counters from the pastes. Returns a dict with the
+        numbers of pastes not expired.'''
+        values = dict(total=Paste.query.count(),
+                      public=Paste.query.filter(Paste.private_id == None)
+                      .count())
+        cls.query.delete()
+        for name in cls.names:
+            db.session.add(cls(name=name, value=values[name]))
+        return dict((name, values[name] - cls.expired(name))
+                    for name in cls.names)
+
+
+@event.listens_for(PasteCounter.__table__, 'after_create')
+def _create_counters(target, connection, **kwargs):
+    connection.execute(target.insert(), [dict(name=name, value=0)
+                                         for name in PasteCounter.names])
+
+
+@event.listens_for(Session, 'after_flush')
+def _count_pastes(session, flush_context):
+    # new, deleted and dirty objects, and their attribute histories, are
+    # still in the pre-flush state. Core inserts must update the counters
+    # themselves.
+    total = public = 0
+    for obj in session.new:
+        if isinstance(obj, Paste):
+            total += 1
+            public += obj.private_id is None
+    for obj in session.deleted:
+        if isinstance(obj, Paste):
+            total -= 1
+            public -= obj.private_id is None
+    for obj in session.dirty:
+        if isinstance(obj, Paste) and obj not in session.deleted:
+            history = inspect(obj).attrs.private_id.history
+            if history.deleted:
+                public += (obj.private_id is None) - \
+                    (history.deleted[0] is None)
+    if total or public:
+        PasteCounter.add(session.connection(), total, public)
+
+
+class RenderedPaste(db.Model):
+
+    rendered_id = db.Column(db.Integer, primary_key=True)
+    paste_id = db.Column(db.Integer, db.ForeignKey('paste.paste_id'),
+                         index=True)
+    render_key = db.Column(db.String(100), unique=True)
+    html = db.Column(db.Text)
+
+    def __init__(self, paste_id, render_key, html):
+        self.paste_id = paste_id
+        self.render_key = render_key
+        self.html = html
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.render_key)
+
+
 class Ip(db.Model):
 
     ip_id = db.Column(db.Integer, primary_key=True)
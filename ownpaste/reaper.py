@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+    ownpaste.reaper
+    ~~~~~~~~~~~~~~~
+
+    Module with the removal of expired pastes.
+
+    Expired pastes are hidden as soon as they expire, and removed from the
+    database later, in batches, by the ``reap`` command or by a job running
+    in the application processes every ``REAPER_INTERVAL`` seconds.
+
+    :copyright: (c) 2012-2013 by Rafael Goncalves Martins
+    :license: BSD, see LICENSE for more details.
+"""
+
+from collections import Counter
+from datetime import datetime
+from ownpaste.models import Blob, Paste, RenderedPaste, db
+
+import os
+import threading
+
+
+def reap(batch_size=500, max_batches=None):
+    '''Removes the expired pastes, in batches of ``batch_size`` pastes, each
+    one in its own transaction. Returns the number of removed pastes and the
+    number of bytes reclaimed, from the contents and rendered HTML freed.'''
+    now = datetime.utcnow()
+    removed = reclaimed = batches = 0
+    while max_batches is None or batches < max_batches:
+        pastes = Paste.query.filter(Paste.expires_at <= now) \
+            .order_by(Paste.expires_at).limit(batch_size).all()
+        if not pastes:
+            break
+
+        # blobs are freed if only used by the pastes of the batch
+        uses = Counter(paste.blob_id for paste in pastes)
+        freed = sum(size or 0 for blob_id, refcount, size in db.session.query(
+            Blob.blob_id, Blob.refcount, db.func.length(Blob.data))
+            .filter(Blob.blob_id.in_(list(uses.keys())))
+            if refcount <= uses[blob_id])
+        freed += db.session.query(db.func.sum(
+            db.func.length(RenderedPaste.html))).filter(
+            RenderedPaste.paste_id.in_([paste.paste_id for paste in pastes])) \
+            .scalar() or 0
+
+        for paste in pastes:
+            paste.remove()
+        db.session.commit()
+        removed += len(pastes)
+        reclaimed += freed
+        batches += 1
+    return removed, reclaimed
+
+
+class ReaperJob(object):
+    '''Runs :func:`reap` periodically, in a background thread of each
+    process, started by the first request.'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def start(self, app):
+        # forked processes don't inherit the thread, then they start their
+        # own
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.schedule(app)
+
+    def schedule(self, app):
+        timer = threading.Timer(float(app.config['REAPER_INTERVAL']),
+                                self.run, (app,))
+        timer.daemon = True
+        timer.start()
+
+    def run(self, app):
+        with app.app_context():
+            try:
+                removed, reclaimed = reap(
+                    int(app.config['REAPER_BATCH_SIZE']))
+                if removed:
+                    app.logger.info('%i expired pastes removed, %i bytes '
+                                    'reclaimed', removed, reclaimed)
+            except Exception:
+                # e.g. pastes removed concurrently by other processes. they
+                # will be retried in the next run.
+                db.session.rollback()
+                app.logger.exception('Failed to remove expired pastes')
+            finally:
+                db.session.remove()
+        if self.pid == os.getpid():
+            self.schedule(app)
+
+
+job = ReaperJob()
+
+
+def init_app(app):
+    if not app.config['REAPER_INTERVAL']:
+        return
+
+    @app.before_request
+    def start_reaper():
+        job.start(app)
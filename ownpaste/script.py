@@ -9,12 +9,23 @@
     :license: BSD, see LICENSE for more details.
 """
 
+from collections import Counter, defaultdict
+from datetime import datetime
 from flask import current_app
 from flask_script import Command, Option, prompt_pass
-from migrate.versioning import api as migrate_api
+from hashlib import sha256
 from ownpaste.auth import HTTPDigestAuth
+from ownpaste.compression import CODECS
+from ownpaste.lexers import guess_language
 from ownpaste.migrations import __file__ as migrations_init
+from ownpaste.models import Blob, Paste, PasteCounter, db, private_ids
+from ownpaste.reaper import reap
+from ownpaste.search import get_backend as get_search_backend
+from ownpaste.server import PreforkServer, warm_up
+from ownpaste.utils import build_languages, save_languages_snapshot
 
+import io
+import json
 import logging
 import os
 import sys
@@ -35,6 +46,367 @@ class GeneratePw(Command):
         print('PASSWORD = \'%s\'' % auth.a1(p1))
 
 
+class LanguagesSnapshot(Command):
+    '''Saves a snapshot of the languages table, for faster startup.'''
+
+    option_list = (Option('file_name', nargs='?'),)
+
+    def run(self, file_name):
+        file_name = file_name or current_app.config['LANGUAGES_SNAPSHOT']
+        if file_name is None:
+            print('No file name provided, and LANGUAGES_SNAPSHOT not set.',
+                  file=sys.stderr)
+            return
+        save_languages_snapshot(file_name, build_languages())
+
+
+class Recompress(Command):
+    '''Recompresses the content of all the pastes with a given codec.'''
+
+    option_list = (
+        Option('--codec', dest='codec', default=None,
+               help='codec name, or \'none\' to decompress. Defaults to '
+               'CONTENT_COMPRESSION'),
+        Option('--batch-size', dest='batch_size', type=int, default=500),
+    )
+
+    def run(self, codec, batch_size):
+        if codec is None:
+            codec = current_app.config['CONTENT_COMPRESSION']
+        elif codec == 'none':
+            codec = None
+        if codec is not None and codec not in CODECS:
+            print('Unsupported codec: %s' % codec, file=sys.stderr)
+            return
+
+        last_id = 0
+        changed = 0
+        while 1:
+            blobs = Blob.query.filter(Blob.blob_id > last_id) \
+                .order_by(Blob.blob_id).limit(batch_size).all()
+            if not blobs:
+                break
+            for blob in blobs:
+                if blob.codec != codec:
+                    blob.store(blob.content.encode('utf-8'), codec)
+                    changed += 1
+            db.session.commit()
+            last_id = blobs[-1].blob_id
+        print('%i paste contents recompressed.' % changed)
+
+
+def _isoformat(date):
+    return date is not None and date.isoformat() or None
+
+
+def _parse_date(value):
+    return value is not None and datetime.fromisoformat(value) or None
+
+
+class Export(Command):
+    '''Exports all the pastes as NDJSON, one paste per line.'''
+
+    option_list = (
+        Option('file_name', nargs='?', default='-',
+               help='output file, or \'-\' for stdout'),
+        Option('--batch-size', dest='batch_size', type=int, default=1000),
+    )
+
+    def run(self, file_name, batch_size):
+        # pastes are fetched from the cursor in batches, then the memory usage
+        # doesn't depend on the number of pastes
+        query = Paste.query \
+            .options(db.joinedload(Paste.blob).undefer(Blob.data)) \
+            .order_by(Paste.paste_id).yield_per(batch_size)
+
+        fp = sys.stdout
+        if file_name != '-':
+            fp = io.open(file_name, 'w', encoding='utf-8')
+        count = 0
+        try:
+            for paste in query:
+                fp.write(json.dumps(dict(
+                    paste_id=paste.paste_id, private_id=paste.private_id,
+                    language=paste.language, file_name=paste.file_name,
+                    file_content=paste.file_content,
+                    pub_date=_isoformat(paste.pub_date),
+                    updated_at=_isoformat(paste.updated_at),
+                    expires_at=_isoformat(paste.expires_at))) + '\n')
+                count += 1
+                if count % batch_size == 0:
+                    print('%i pastes exported.' % count, file=sys.stderr)
+        finally:
+            if fp is not sys.stdout:
+                fp.close()
+        print('%i pastes exported.' % count, file=sys.stderr)
+
+
+class Import(Command):
+    '''Imports pastes from a NDJSON file created by the export command.
+
+    Pastes are inserted in batches, each one in its own transaction, keeping
+    their ids. Importing into a database with pastes requires ``--resume``,
+    that skips the pastes with ids lower than the highest id in the
+    database, then an interrupted import can be resumed by running the
+    command again, or ``--renumber``, that gives new ids to the pastes whose
+    ids are already used. Private ids already used are always replaced.
+    Resuming requires all the pastes to have a ``paste_id``.
+    '''
+
+    option_list = (
+        Option('file_name', nargs='?', default='-',
+               help='input file, or \'-\' for stdin'),
+        Option('--batch-size', dest='batch_size', type=int, default=1000,
+               help='number of pastes inserted per commit'),
+        Option('--resume', dest='resume', action='store_true',
+               default=False,
+               help='skip the pastes up to the highest id in the database'),
+        Option('--renumber', dest='renumber', action='store_true',
+               default=False,
+               help='give new ids to the pastes whose ids are already used'),
+    )
+
+    def run(self, file_name, batch_size, resume, renumber):
+        if resume and renumber:
+            print('--resume and --renumber are mutually exclusive.',
+                  file=sys.stderr)
+            return 1
+        last_id = db.session.query(db.func.max(Paste.paste_id)).scalar() or 0
+        if last_id and not (resume or renumber):
+            print('The database has pastes. Use --resume to resume an '
+                  'interrupted import, or --renumber to give new ids to the '
+                  'pastes whose ids are already used.', file=sys.stderr)
+            return 1
+        if last_id and resume:
+            print('Resuming after paste %i.' % last_id, file=sys.stderr)
+        else:
+            last_id = 0
+
+        fp = sys.stdin
+        if file_name != '-':
+            fp = io.open(file_name, encoding='utf-8')
+        self.renumbered = self.private_ids_replaced = 0
+        count = skipped = 0
+        batch = []
+        try:
+            for lineno, line in enumerate(fp, 1):
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                paste_id = item.get('paste_id')
+
+                # pastes without id can't be told apart from the ones
+                # already imported
+                if resume and paste_id is None:
+                    print('Paste without paste_id in line %i, it can\'t be '
+                          'resumed.' % lineno, file=sys.stderr)
+                    return 1
+                if paste_id is not None and paste_id <= last_id:
+                    skipped += 1
+                    continue
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    count += self.import_batch(batch, renumber)
+                    batch = []
+                    print('%i pastes imported.' % count, file=sys.stderr)
+            if batch:
+                count += self.import_batch(batch, renumber)
+        finally:
+            if fp is not sys.stdin:
+                fp.close()
+
+        # explicit ids don't advance postgresql sequences
+        if db.engine.name == 'postgresql':
+            db.session.execute(db.text(
+                'SELECT setval(pg_get_serial_sequence(\'paste\', '
+                '\'paste_id\'), (SELECT max(paste_id) FROM paste))'))
+            db.session.commit()
+        print('%i pastes imported.' % count, file=sys.stderr)
+        if skipped:
+            print('%i pastes skipped, already imported.' % skipped,
+                  file=sys.stderr)
+        if self.renumbered:
+            print('%i pastes renumbered.' % self.renumbered, file=sys.stderr)
+        if self.private_ids_replaced:
+            print('%i private ids replaced.' % self.private_ids_replaced,
+                  file=sys.stderr)
+
+    def import_batch(self, batch, renumber=False):
+        batch = [dict(item) for item in batch]
+
+        # ids already used are given to other pastes
+        if renumber:
+            ids = [item['paste_id'] for item in batch
+                   if item.get('paste_id') is not None]
+            used = set(paste_id for paste_id, in db.session.query(
+                Paste.paste_id).filter(Paste.paste_id.in_(ids)))
+            for item in batch:
+                if item.get('paste_id') in used:
+                    item['paste_id'] = None
+                    self.renumbered += 1
+        ids = [item['private_id'] for item in batch
+               if item.get('private_id') is not None]
+        used = set(private_id for private_id, in db.session.query(
+            Paste.private_id).filter(Paste.private_id.in_(ids)))
+        for item in batch:
+            if item.get('private_id') in used:
+                item['private_id'] = private_ids.get()
+                self.private_ids_replaced += 1
+
+        contents = [item['file_content'] for item in batch]
+        datas = [fc.encode('utf-8') for fc in contents]
+        hashes = [sha256(data).hexdigest() for data in datas]
+        counts = Counter(hashes)
+
+        # reuse the existing blobs, incrementing their reference counts
+        blob_ids = dict(db.session.query(Blob.content_hash, Blob.blob_id)
+                        .filter(Blob.content_hash.in_(list(counts.keys()))))
+        increments = defaultdict(list)
+        for content_hash, blob_id in blob_ids.items():
+            increments[counts[content_hash]].append(blob_id)
+        for n, ids in increments.items():
+            Blob.query.filter(Blob.blob_id.in_(ids)).update(
+                {Blob.refcount: Blob.refcount + n},
+                synchronize_session=False)
+
+        # and create the missing ones
+        codec = current_app.config['CONTENT_COMPRESSION']
+        blobs = {}
+        for content_hash, data in zip(hashes, datas):
+            if content_hash not in blob_ids and content_hash not in blobs:
+                blob = blobs[content_hash] = Blob(content_hash, data, codec)
+                blob.refcount = counts[content_hash]
+                db.session.add(blob)
+        db.session.flush()
+        for content_hash, blob in blobs.items():
+            blob_ids[content_hash] = blob.blob_id
+
+        # pastes without id get the next ones, then they can be indexed
+        next_id = None
+        if any(item.get('paste_id') is None for item in batch):
+            next_id = (db.session.query(db.func.max(Paste.paste_id))
+                       .scalar() or 0) + 1
+            for item in batch:
+                paste_id = item.get('paste_id')
+                if paste_id is not None:
+                    next_id = max(next_id, paste_id + 1)
+
+        rows = []
+        for item, fc, content_hash in zip(batch, contents, hashes):
+            paste_id = item.get('paste_id')
+            if paste_id is None:
+                paste_id = next_id
+                next_id += 1
+            language = item.get('language')
+            if language is None:
+                language = guess_language(
+                    fc, item.get('file_name'),
+                    current_app.config['LANGUAGE_GUESS_SAMPLE'],
+                    current_app.config['LANGUAGE_GUESS_TIMEOUT'])
+            row = dict(paste_id=paste_id,
+                       private_id=item.get('private_id'), language=language,
+                       file_name=item.get('file_name'),
+                       blob_id=blob_ids[content_hash],
+                       pub_date=_parse_date(item.get('pub_date')) or
+                       datetime.utcnow(),
+                       updated_at=_parse_date(item.get('updated_at')),
+                       expires_at=_parse_date(item.get('expires_at')))
+            row.update(Paste.content_metadata(fc))
+            rows.append(row)
+        db.session.execute(Paste.__table__.insert(), rows)
+
+        # the rows are inserted without the orm, then the counters and the
+        # search index must be updated here
+        PasteCounter.add(db.session.connection(), total=len(rows),
+                         public=len([row for row in rows
+                                     if row['private_id'] is None]))
+        search = get_search_backend()
+        if search is not None:
+            search.index(db.session.connection(), [
+                (row['paste_id'], row['file_name'], fc)
+                for row, fc in zip(rows, contents)])
+        db.session.commit()
+        return len(rows)
+
+
+class Reap(Command):
+    '''Removes the expired pastes.'''
+
+    option_list = (
+        Option('--batch-size', dest='batch_size', type=int, default=500,
+               help='number of pastes removed per commit'),
+        Option('--max-batches', dest='max_batches', type=int, default=None,
+               help='stop after this number of batches'),
+    )
+
+    def run(self, batch_size, max_batches):
+        removed, reclaimed = reap(batch_size, max_batches)
+        print('%i expired pastes removed, %i bytes reclaimed.' %
+              (removed, reclaimed))
+
+
+class Recount(Command):
+    '''Recomputes the paste counters, used by the listings.'''
+
+    def run(self):
+        counters = PasteCounter.recount()
+        db.session.commit()
+        print('%(total)i pastes, %(public)i public.' % counters)
+
+
+class Reindex(Command):
+    '''Rebuilds the full-text search index.'''
+
+    option_list = (
+        Option('--batch-size', dest='batch_size', type=int, default=500),
+    )
+
+    def run(self, batch_size):
+        search = get_search_backend()
+        if search is None:
+            print('Full-text search isn\'t supported by this database.',
+                  file=sys.stderr)
+            return
+
+        last_id = 0
+        count = 0
+        while 1:
+            pastes = Paste.query \
+                .options(db.joinedload(Paste.blob).undefer(Blob.data)) \
+                .filter(Paste.paste_id > last_id) \
+                .order_by(Paste.paste_id).limit(batch_size).all()
+            if not pastes:
+                break
+            search.index(db.session.connection(), [
+                (paste.paste_id, paste.file_name, paste.file_content)
+                for paste in pastes])
+            db.session.commit()
+            count += len(pastes)
+            last_id = pastes[-1].paste_id
+            print('%i pastes indexed.' % count, file=sys.stderr)
+        search.prune(db.session.connection())
+        db.session.commit()
+        print('%i pastes indexed.' % count)
+
+
+class Serve(Command):
+    '''Runs ownpaste with a pre-forking multi-process server.'''
+
+    option_list = (
+        Option('-H', '--host', dest='host', default='127.0.0.1'),
+        Option('-p', '--port', dest='port', type=int, default=5000),
+        Option('-w', '--workers', dest='workers', type=int, default=None,
+               help='number of worker processes. Defaults to SERVE_WORKERS'),
+    )
+
+    def run(self, host, port, workers):
+        app = current_app._get_current_object()
+        if workers is None:
+            workers = int(app.config['SERVE_WORKERS'])
+        warm_up(app)
+        PreforkServer(app, host, port, workers).serve_forever()
+
+
 class SingleLevelFilter(logging.Filter):
     def __init__(self, min=None, max=None):
         self.min = min or 0
@@ -46,9 +418,15 @@ class SingleLevelFilter(logging.Filter):
 
 class MigrateBase(Command):
 
+    @property
+    def migrate_api(self):
+        # sqlalchemy-migrate is slow to import, and only needed here
+        from migrate.versioning import api
+        return api
+
     def init_logging(self):
         # code snippet from sqlalchemy-migrate
-        logger = migrate_api.log
+        logger = self.migrate_api.log
         h1 = logging.StreamHandler(sys.stdout)
         f1 = SingleLevelFilter(max=logging.INFO)
         h1.addFilter(f1)
@@ -75,8 +453,9 @@ class DbVersionControl(MigrateBase):
 
     def run(self, version):
         self.init_logging()
-        migrate_api.version_control(url=self.dburi, repository=self.repository,
-                                    version=version)
+        self.migrate_api.version_control(url=self.dburi,
+                                         repository=self.repository,
+                                         version=version)
 
 
 class DbUpgrade(MigrateBase):
@@ -86,8 +465,8 @@ class DbUpgrade(MigrateBase):
 
     def run(self, version):
         self.init_logging()
-        migrate_api.upgrade(url=self.dburi, repository=self.repository,
-                            version=version)
+        self.migrate_api.upgrade(url=self.dburi, repository=self.repository,
+                                 version=version)
 
 
 class DbDowngrade(MigrateBase):
@@ -97,8 +476,9 @@ class DbDowngrade(MigrateBase):
 
     def run(self, version):
         self.init_logging()
-        migrate_api.downgrade(url=self.dburi, repository=self.repository,
-                              version=version)
+        self.migrate_api.downgrade(url=self.dburi,
+                                   repository=self.repository,
+                                   version=version)
 
 
 class DbVersion(MigrateBase):
@@ -106,5 +486,5 @@ class DbVersion(MigrateBase):
 
     def run(self):
         self.init_logging()
-        print(migrate_api.db_version(url=self.dburi,
-                                     repository=self.repository))
+        print(self.migrate_api.db_version(url=self.dburi,
+                                          repository=self.repository))
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+    ownpaste.search
+    ~~~~~~~~~~~~~~~
+
+    Module with the full-text search index of pastes.
+
+    The index is stored in the ``paste_search`` table, a FTS5 virtual table on
+    SQLite, or a table with a ``tsvector`` column on PostgreSQL. Other
+    databases don't support searching. The index is updated in the same
+    transaction as the pastes, by SQL-Alchemy mapper events.
+
+    :copyright: (c) 2012-2013 by Rafael Goncalves Martins
+    :license: BSD, see LICENSE for more details.
+"""
+
+from flask import current_app
+from ownpaste.models import Paste, db
+from sqlalchemy import event, inspect
+
+
+class SearchBackend(object):
+
+    def create(self, connection):
+        '''Creates the index table.'''
+        raise NotImplementedError
+
+    def drop(self, connection):
+        connection.execute(db.text('DROP TABLE IF EXISTS paste_search'))
+
+    def index(self, connection, rows):
+        '''Adds or replaces the entries for a list of ``(paste_id,
+        file_name, file_content)`` tuples.'''
+        raise NotImplementedError
+
+    def remove(self, connection, paste_ids):
+        raise NotImplementedError
+
+    def prune(self, connection):
+        '''Removes the entries of pastes that don't exist anymore.'''
+        raise NotImplementedError
+
+    def query(self, q, hide_private=True):
+        '''Returns a query with the pastes matching ``q``, best matches
+        first.'''
+        raise NotImplementedError
+
+    def _rows(self, rows):
+        max_size = int(current_app.config['SEARCH_INDEX_MAX_SIZE'])
+        return [dict(paste_id=paste_id, file_name=file_name or '',
+                     file_content=file_content[:max_size])
+                for paste_id, file_name, file_content in rows]
+
+
+class SqliteSearch(SearchBackend):
+
+    table = db.table('paste_search', db.column('rowid'))
+
+    def create(self, connection):
+        connection.execute(db.text(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS paste_search USING '
+            'fts5(file_name, file_content)'))
+
+    def index(self, connection, rows):
+        rows = self._rows(rows)
+        if not rows:
+            return
+        self.remove(connection, [row['paste_id'] for row in rows])
+        connection.execute(db.text(
+            'INSERT INTO paste_search (rowid, file_name, file_content) '
+            'VALUES (:paste_id, :file_name, :file_content)'), rows)
+
+    def remove(self, connection, paste_ids):
+        if paste_ids:
+            connection.execute(db.text(
+                'DELETE FROM paste_search WHERE rowid = :paste_id'),
+                [dict(paste_id=i) for i in paste_ids])
+
+    def prune(self, connection):
+        connection.execute(db.text(
+            'DELETE FROM paste_search WHERE rowid NOT IN '
+            '(SELECT paste_id FROM paste)'))
+
+    def query(self, q, hide_private=True):
+        # each word is quoted, then user input can't use (or break) the fts5
+        # query syntax. all the words must match.
+        match = ' '.join('"%s"' % word.replace('"', '""')
+                         for word in q.split())
+        return Paste.all(hide_private) \
+            .join(self.table, self.table.c.rowid == Paste.paste_id) \
+            .filter(db.text('paste_search MATCH :q')) \
+            .params(q=match) \
+            .order_by(None) \
+            .order_by(db.text('bm25(paste_search, 10.0, 1.0)'),
+                      Paste.paste_id.desc())
+
+
+class PostgresSearch(SearchBackend):
+
+    table = db.table('paste_search', db.column('paste_id'),
+                     db.column('document'))
+
+    def create(self, connection):
+        connection.execute(db.text(
+            'CREATE TABLE IF NOT EXISTS paste_search ('
+            'paste_id INTEGER PRIMARY KEY REFERENCES paste (paste_id) '
+            'ON DELETE CASCADE, document TSVECTOR NOT NULL)'))
+        connection.execute(db.text(
+            'CREATE INDEX IF NOT EXISTS ix_paste_search_document ON '
+            'paste_search USING GIN (document)'))
+
+    def index(self, connection, rows):
+        rows = self._rows(rows)
+        if not rows:
+            return
+        connection.execute(db.text(
+            'INSERT INTO paste_search (paste_id, document) VALUES '
+            '(:paste_id, '
+            'setweight(to_tsvector(\'simple\', :file_name), \'A\') || '
+            'setweight(to_tsvector(\'simple\', :file_content), \'B\')) '
+            'ON CONFLICT (paste_id) DO UPDATE SET '
+            'document = excluded.document'), rows)
+
+    def remove(self, connection, paste_ids):
+        if paste_ids:
+            connection.execute(db.text(
+                'DELETE FROM paste_search WHERE paste_id = :paste_id'),
+                [dict(paste_id=i) for i in paste_ids])
+
+    def prune(self, connection):
+        connection.execute(db.text(
+            'DELETE FROM paste_search WHERE paste_id NOT IN '
+            '(SELECT paste_id FROM paste)'))
+
+    def query(self, q, hide_private=True):
+        tsquery = db.func.websearch_to_tsquery('simple', q)
+        document = self.table.c.document
+        return Paste.all(hide_private) \
+            .join(self.table, self.table.c.paste_id == Paste.paste_id) \
+            .filter(document.op('@@')(tsquery)) \
+            .order_by(None) \
+            .order_by(db.func.ts_rank(document, tsquery).desc(),
+                      Paste.paste_id.desc())
+
+
+BACKENDS = {
+    'sqlite': SqliteSearch(),
+    'postgresql': PostgresSearch(),
+}
+
+
+def get_backend(name=None):
+    '''Returns the search backend for a database dialect, or the configured
+    database, if not provided. Returns None if searching isn't supported.'''
+    if name is None:
+        name = db.engine.name
+    return BACKENDS.get(name)
+
+
+@event.listens_for(Paste.__table__, 'after_create')
+def _create_index(target, connection, **kwargs):
+    backend = get_backend(connection.dialect.name)
+    if backend is not None:
+        backend.create(connection)
+
+
+@event.listens_for(Paste.__table__, 'before_drop')
+def _drop_index(target, connection, **kwargs):
+    backend = get_backend(connection.dialect.name)
+    if backend is not None:
+        backend.drop(connection)
+
+
+@event.listens_for(Paste, 'after_insert')
+def _index_inserted(mapper, connection, target):
+    backend = get_backend(connection.dialect.name)
+    if backend is not None:
+        backend.index(connection, [(target.paste_id, target.file_name,
+                                    target.file_content)])
+
+
+@event.listens_for(Paste, 'after_update')
+def _index_updated(mapper, connection, target):
+    backend = get_backend(connection.dialect.name)
+    if backend is None:
+        return
+    attrs = inspect(target).attrs
+    if attrs.blob.history.has_changes() or \
+       attrs.file_name.history.has_changes():
+        backend.index(connection, [(target.paste_id, target.file_name,
+                                    target.file_content)])
+
+
+@event.listens_for(Paste, 'after_delete')
+def _index_deleted(mapper, connection, target):
+    backend = get_backend(connection.dialect.name)
+    if backend is not None:
+        backend.remove(connection, [target.paste_id])
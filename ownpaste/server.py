@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+    ownpaste.server
+    ~~~~~~~~~~~~~~~
+
+    Module with a pre-forking WSGI server, for production deployments.
+
+    The application is created and warmed up in the parent process, then the
+    languages table, the Pygments lexers and styles and the compiled templates
+    are shared by all the worker processes, copy-on-write.
+
+    :copyright: (c) 2012-2013 by Rafael Goncalves Martins
+    :license: BSD, see LICENSE for more details.
+"""
+
+from ownpaste.highlight import render
+from ownpaste.lexers import get_index
+from ownpaste.models import db
+from ownpaste.throttle import close_stores
+from ownpaste.utils import get_languages
+from pygments.styles import get_all_styles, get_style_by_name
+from werkzeug.serving import make_server
+
+import gc
+import os
+import random
+import signal
+import sys
+import time
+
+WARMUP_SAMPLE = u'''\
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+def hello(name="world"):
+    """Says hello."""
+    return 'Hello, %s! <%d>' % (name, 42)
+'''
+
+
+def warm_up(app):
+    '''Loads everything that would be lazily loaded by the first requests.
+
+    The lexers of the languages in the ``SERVE_WARMUP_LANGUAGES``
+    configuration parameter (all of them, if None) are compiled by rendering
+    a sample with each one of them.
+    '''
+    with app.app_context():
+        languages = get_languages()
+
+        # import all the lexer classes, and compile the lexers to be used
+        index = get_index()
+        for alias in index.lexers:
+            index.lexer_class(alias)
+        warmup_languages = app.config['SERVE_WARMUP_LANGUAGES']
+        if warmup_languages is None:
+            warmup_languages = list(languages.keys())
+        for alias in warmup_languages:
+            lexer = index.lexer_class(index.by_name(alias) or alias)
+            if lexer is None:
+                continue
+            try:
+                render(WARMUP_SAMPLE, lexer(),
+                       app.config['PYGMENTS_STYLE'],
+                       app.config['PYGMENTS_LINENOS'])
+            except Exception:
+                # some lexers require options, they are just imported
+                pass
+
+        for style in get_all_styles():
+            get_style_by_name(style)
+
+        for template in app.jinja_env.list_templates():
+            app.jinja_env.get_template(template)
+
+        # connections can't be shared by the workers
+        for bind in [None] + list(app.config['SQLALCHEMY_BINDS'] or ()):
+            db.get_engine(app, bind).dispose()
+
+    # objects created until now are never freed, then the garbage collector
+    # doesn't need to touch them, that would copy their memory pages.
+    gc.collect()
+    gc.freeze()
+
+
+class PreforkServer(object):
+    '''Serves a WSGI application with a pool of forked worker processes,
+    sharing the listening socket. Dead workers are replaced.'''
+
+    def __init__(self, app, host, port, workers):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.children = {}  # pid -> start time
+        self.running = False
+        self.server = None
+
+    def log(self, message, *args):
+        print('[%i] %s' % (os.getpid(), message % args), file=sys.stderr)
+
+    def spawn(self):
+        pid = os.fork()
+        if pid != 0:
+            self.children[pid] = time.time()
+            return
+
+        # worker process. os._exit() doesn't run the atexit handlers, then
+        # the buffered throttling state is written here.
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        random.seed()
+        status = 0
+        try:
+            self.server.serve_forever()
+        except Exception:
+            status = 1
+        finally:
+            try:
+                close_stores()
+            finally:
+                os._exit(status)
+
+    def stop(self, signum, frame):
+        self.running = False
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def serve_forever(self):
+        self.server = make_server(self.host, self.port, self.app)
+        self.log('Serving on http://%s:%i/ with %i workers', self.host,
+                 self.server.server_port, self.workers)
+        self.running = True
+        for i in range(self.workers):
+            self.spawn()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            started = self.children.pop(pid, None)
+            if started is None or not self.running:
+                continue
+            self.log('Worker %i died, respawning', pid)
+
+            # avoid respawning too fast workers that die at startup
+            if time.time() - started < 1:
+                time.sleep(1)
+            self.spawn()
+        self.server.server_close()
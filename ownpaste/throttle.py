@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+    ownpaste.throttle
+    ~~~~~~~~~~~~~~~~~
+
+    Module with the stores for the authentication throttling state: failed
+    authentication hits and blocked ips.
+
+    The store is selected with the ``AUTH_THROTTLE_BACKEND`` configuration
+    parameter:
+
+    ``memory``
+        State kept in the process memory. Failures are counted in a sliding
+        window of ``IP_BLOCK_WINDOW`` minutes. Nothing is written to the
+        database, but each process has its own state.
+
+    ``database``
+        State kept in the ``ip`` table, shared by all the processes. Changes
+        are buffered and written in batches by a background thread, every
+        ``AUTH_THROTTLE_FLUSH_INTERVAL`` seconds, and when the process exits.
+
+    :copyright: (c) 2012-2013 by Rafael Goncalves Martins
+    :license: BSD, see LICENSE for more details.
+"""
+
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from flask import current_app
+from ownpaste.models import Ip, db
+
+import atexit
+import threading
+import time
+
+
+class ThrottleStore(object):
+    '''Base class for throttling stores.'''
+
+    def blocked(self, ip):
+        '''Returns True if the ip is blocked. Expired blocks are lifted.'''
+        raise NotImplementedError
+
+    def failure(self, ip):
+        '''Registers a failed authentication. Returns True if the ip was
+        blocked.'''
+        raise NotImplementedError
+
+    def success(self, ip):
+        '''Forgets the state of an ip, after a successful authentication.'''
+        raise NotImplementedError
+
+    def close(self):
+        '''Writes any buffered state, before the process exits.'''
+        pass
+
+    @property
+    def max_hits(self):
+        return int(current_app.config['IP_BLOCK_HITS'])
+
+    @property
+    def timeout(self):
+        return float(current_app.config['IP_BLOCK_TIMEOUT']) * 60
+
+
+class MemoryEntry(object):
+
+    __slots__ = ('failures', 'blocked_until')
+
+    def __init__(self):
+        self.failures = deque()
+        self.blocked_until = None
+
+
+class MemoryStore(ThrottleStore):
+    '''Keeps the throttling state in memory.
+
+    At most ``max_entries`` ips are tracked, the least recently used ones
+    being forgotten first.
+    '''
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def _entry(self, ip, create=False):
+        # must be called with the lock held
+        entry = self.entries.get(ip)
+        if entry is not None:
+            self.entries.move_to_end(ip)
+        elif create:
+            entry = self.entries[ip] = MemoryEntry()
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+
+    def blocked(self, ip):
+        with self.lock:
+            entry = self._entry(ip)
+            if entry is None or entry.blocked_until is None:
+                return False
+            if entry.blocked_until > time.time():
+                return True
+            entry.blocked_until = None
+            entry.failures.clear()
+            return False
+
+    def failure(self, ip):
+        window = float(current_app.config['IP_BLOCK_WINDOW']) * 60
+        now = time.time()
+        with self.lock:
+            entry = self._entry(ip, create=True)
+            while entry.failures and entry.failures[0] <= now - window:
+                entry.failures.popleft()
+            entry.failures.append(now)
+            if len(entry.failures) < self.max_hits:
+                return False
+            entry.failures.clear()
+            entry.blocked_until = now + self.timeout
+            return True
+
+    def success(self, ip):
+        with self.lock:
+            self.entries.pop(ip, None)
+
+
+class DatabaseStore(ThrottleStore):
+    '''Keeps the throttling state in the ``ip`` table.
+
+    The state is read from the database, overlaid with the changes not
+    written yet. Changes are only buffered in the request, then successful
+    authentications don't write to the database.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}  # ip -> state dict, or None to delete the row
+        self.timer = None
+        self.app = None
+
+    def _state(self, ip):
+        with self.lock:
+            if ip in self.pending:
+                state = self.pending[ip]
+                return state is not None and dict(state) or None
+        obj = Ip.query.filter(Ip.ip == ip).first()
+        if obj is None:
+            return None
+        return dict(hits=obj.hits, blocked_date=obj.blocked_date)
+
+    def _set(self, ip, state):
+        with self.lock:
+            self.pending[ip] = state
+            self._schedule(current_app._get_current_object())
+
+    def _schedule(self, app):
+        # must be called with the lock held
+        self.app = app
+        if self.timer is None:
+            interval = float(app.config['AUTH_THROTTLE_FLUSH_INTERVAL'])
+            self.timer = threading.Timer(interval, self.flush, (app,))
+            self.timer.daemon = True
+            self.timer.start()
+
+    def blocked(self, ip):
+        state = self._state(ip)
+        if state is None or state['blocked_date'] is None:
+            return False
+        timeout = timedelta(seconds=self.timeout)
+        if state['blocked_date'] + timeout > datetime.utcnow():
+            return True
+        state.update(hits=0, blocked_date=None)
+        self._set(ip, state)
+        return False
+
+    def failure(self, ip):
+        state = self._state(ip) or dict(hits=0, blocked_date=None)
+        state['hits'] += 1
+        blocked = state['hits'] >= self.max_hits
+        if blocked:
+            state['blocked_date'] = datetime.utcnow()
+        self._set(ip, state)
+        return blocked
+
+    def success(self, ip):
+        if self._state(ip) is not None:
+            self._set(ip, None)
+
+    def flush(self, app):
+        '''Writes the buffered changes to the database, in a single
+        transaction.'''
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.timer = None
+        if not pending:
+            return
+        with app.app_context():
+            try:
+                deleted = [ip for ip, state in pending.items()
+                           if state is None]
+                if deleted:
+                    Ip.query.filter(Ip.ip.in_(deleted)).delete(
+                        synchronize_session=False)
+                updated = dict((ip, state) for ip, state in pending.items()
+                               if state is not None)
+                if updated:
+                    objs = dict((obj.ip, obj) for obj in Ip.query.filter(
+                        Ip.ip.in_(list(updated.keys()))))
+                    for ip, state in updated.items():
+                        obj = objs.get(ip)
+                        if obj is None:
+                            obj = Ip(ip)
+                            db.session.add(obj)
+                        obj.hits = state['hits']
+                        obj.blocked_date = state['blocked_date']
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                app.logger.exception('Failed to save the throttling state')
+
+                # keep the changes for the next flush, unless superseded
+                with self.lock:
+                    for ip, state in pending.items():
+                        self.pending.setdefault(ip, state)
+                    self._schedule(app)
+            finally:
+                db.session.remove()
+
+    def close(self):
+        with self.lock:
+            app = self.app
+            if self.timer is not None:
+                self.timer.cancel()
+        if app is not None:
+            self.flush(app)
+
+
+BACKENDS = {
+    'memory': MemoryStore,
+    'database': DatabaseStore,
+}
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store():
+    '''Returns the throttling store configured for the current app.'''
+    name = current_app.config['AUTH_THROTTLE_BACKEND']
+    with _stores_lock:
+        store = _stores.get(name)
+        if store is None:
+            try:
+                store = _stores[name] = BACKENDS[name]()
+            except KeyError:
+                raise ValueError('Unsupported throttling backend: %s' % name)
+        return store
+
+
+@atexit.register
+def close_stores():
+    '''Writes the buffered state of all the stores.'''
+    with _stores_lock:
+        stores = list(_stores.values())
+    for store in stores:
+        store.close()
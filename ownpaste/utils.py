@@ -10,13 +10,22 @@
 """
 
 from collections import OrderedDict
-from flask import jsonify as flask_jsonify, request
+from flask import current_app, has_app_context, jsonify as flask_jsonify, \
+     request
 from jinja2 import Markup
-from pygments.lexers import get_all_lexers
+from ownpaste.metrics import timed
 from werkzeug.exceptions import HTTPException
 
+import json
+import pygments
+import threading
 
-def _languages():
+_languages = None
+_languages_lock = threading.Lock()
+
+
+def build_languages():
+    from pygments.lexers import get_all_lexers
     rv = OrderedDict()
     lexers = list(get_all_lexers())
     lexers.sort(key=lambda x: x[0])
@@ -25,8 +34,44 @@ def _languages():
             rv[alias] = lexer[0]
     return rv
 
-LANGUAGES = _languages()
-del _languages
+
+def load_languages_snapshot(file_name):
+    try:
+        with open(file_name, 'r', encoding='utf-8') as fp:
+            data = json.load(fp)
+    except (IOError, OSError, ValueError):
+        return None
+
+    # the snapshot is only valid for the pygments version that generated it
+    if data.get('pygments_version') != pygments.__version__:
+        return None
+    return OrderedDict(data['languages'])
+
+
+def save_languages_snapshot(file_name, languages):
+    with open(file_name, 'w', encoding='utf-8') as fp:
+        json.dump(dict(pygments_version=pygments.__version__,
+                       languages=list(languages.items())), fp)
+
+
+def get_languages():
+    '''Returns an ordered mapping of language aliases to language names.
+
+    The mapping is built on the first call, from the snapshot file set in the
+    ``LANGUAGES_SNAPSHOT`` configuration parameter, if it matches the
+    installed Pygments version, or from the Pygments lexers otherwise.
+    '''
+    global _languages
+    if _languages is None:
+        with _languages_lock:
+            if _languages is None:
+                rv = None
+                if has_app_context():
+                    snapshot = current_app.config.get('LANGUAGES_SNAPSHOT')
+                    if snapshot is not None:
+                        rv = load_languages_snapshot(snapshot)
+                _languages = rv if rv is not None else build_languages()
+    return _languages
 
 
 def jsonify(*args, **kwargs):
@@ -36,6 +81,7 @@ def jsonify(*args, **kwargs):
     return flask_jsonify(rv)
 
 
+@timed('negotiate')
 def request_wants_json():
     # based on: http://flask.pocoo.org/snippets/45/
     best = request.accept_mimetypes \
@@ -9,36 +9,251 @@
     :license: BSD, see LICENSE for more details.
 """
 
+from datetime import datetime, timedelta
 from flask import Blueprint, abort, current_app, make_response, \
-     render_template, request
+     render_template, request, url_for
 from flask.views import MethodView
-from pygments.formatters import HtmlFormatter
+from flask_sqlalchemy import Pagination
 from ownpaste.auth import HTTPDigestAuth
-from ownpaste.models import Paste, db
-from ownpaste.utils import LANGUAGES, jsonify, request_wants_json
-
+from ownpaste.metrics import registry, timed
+from ownpaste.models import Paste, PasteCounter, commit_pastes, db, \
+     private_ids, reading
+from ownpaste.search import get_backend as get_search_backend
+from ownpaste.utils import get_languages, jsonify, request_wants_json
+from ownpaste.workers import guess_pool, render_queue
+from werkzeug.http import is_resource_modified
+
+import json
 import os
 import ownpaste
 
 views = Blueprint('views', __name__)
 
 
+def render_html(template_name, **context):
+    with timed('template'):
+        return render_template(template_name, **context)
+
+
 @views.route('/')
 def home():
     if request_wants_json():
         return jsonify(dict(version=ownpaste.__version__,
                             api_version=ownpaste.api_version,
-                            languages=LANGUAGES))
-    return render_template('base.html', version=ownpaste.__version__,
-                           api_version=ownpaste.api_version,
-                           languages=LANGUAGES.items())
+                            languages=get_languages()))
+    return render_html('base.html', version=ownpaste.__version__,
+                       api_version=ownpaste.api_version,
+                       languages=get_languages().items())
+
+
+def get_stylesheet(name):
+    return current_app.extensions['ownpaste_stylesheets'].by_name[name]
+
+
+@views.app_template_global()
+def stylesheet_url(name):
+    return url_for('views.stylesheet_file',
+                   filename=get_stylesheet(name).filename)
+
+
+def stylesheet_response(stylesheet, max_age):
+    # the gzip content is a different representation, with its own etag
+    gzip = request.accept_encodings['gzip'] > 0
+    etag = gzip and stylesheet.etag + '-gzip' or stylesheet.etag
+    if not is_resource_modified(request.environ, etag=etag):
+        response = current_app.response_class(status=304)
+    elif gzip:
+        response = make_response(stylesheet.gzip_content)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = make_response(stylesheet.content)
+    response.headers['Content-Type'] = 'text/css; charset=utf-8'
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    return response
+
+
+@views.route('/assets/<filename>')
+def stylesheet_file(filename):
+    stylesheets = current_app.extensions['ownpaste_stylesheets']
+    stylesheet = stylesheets.by_filename.get(filename)
+    if stylesheet is None:
+        abort(404)
+
+    # the file name changes with the content, then it can be cached forever
+    response = stylesheet_response(stylesheet, 31536000)
+    response.headers['Cache-Control'] += ', immutable'
+    return response
 
 
 @views.route('/pygments.css')
 def pygments_css():
-    formatter = HtmlFormatter(style=current_app.config['PYGMENTS_STYLE'])
-    response = make_response(formatter.get_style_defs(('#paste', '.syntax')))
-    response.headers['Content-Type'] = 'text/css'
+    # kept for old links, the templates use the fingerprinted stylesheet
+    return stylesheet_response(get_stylesheet('pygments'), 3600)
+
+
+@views.route('/token/', methods=['POST'])
+def token():
+    # tokens can't be used to create new tokens, otherwise they would never
+    # expire
+    auth = HTTPDigestAuth()
+    auth.required(allow_token=False)
+    expires_in = int(current_app.config['AUTH_TOKEN_EXPIRY'])
+    return jsonify(dict(token=auth.create_token(), expires_in=expires_in))
+
+
+@views.route('/metrics')
+def metrics():
+    HTTPDigestAuth().required()
+    response = make_response(registry.expose())
+    response.headers['Content-Type'] = \
+        'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+
+def parse_paste(data):
+    '''Validates the JSON object of a new paste, returning the arguments of
+    :class:`~ownpaste.models.Paste`. Raises :exc:`ValueError` if the object
+    is invalid.'''
+    if not isinstance(data, dict):
+        raise ValueError('Paste must be an object')
+    file_name = data.get('file_name')
+    if file_name is not None and not isinstance(file_name, str):
+        raise ValueError('Invalid file_name')
+    language = data.get('language')
+    if language is not None and not isinstance(language, str):
+        raise ValueError('Invalid language')
+    private = data.get('private', False)
+    if not isinstance(private, bool):
+        raise ValueError('Invalid private flag')
+    try:
+        file_content = data['file_content']
+    except KeyError:
+        raise ValueError('Missing file_content')
+    if not isinstance(file_content, str):
+        raise ValueError('Invalid file_content')
+    return file_content, file_name, language, private, parse_expiry(data)
+
+
+def parse_expiry(data):
+    '''Returns the expiration date set in the JSON object of a paste, as
+    ``expires_in`` seconds or as an ``expires_timestamp`` UTC Unix
+    timestamp, or None.'''
+    expires_in = data.get('expires_in')
+    expires_timestamp = data.get('expires_timestamp')
+    try:
+        if expires_in is not None:
+            if isinstance(expires_in, bool) or expires_in <= 0:
+                raise ValueError
+            return datetime.utcnow() + timedelta(seconds=expires_in)
+        if expires_timestamp is not None:
+            if isinstance(expires_timestamp, bool):
+                raise ValueError
+            rv = datetime.utcfromtimestamp(expires_timestamp)
+            if rv <= datetime.utcnow():
+                raise ValueError
+            return rv
+    except (TypeError, ValueError, OverflowError, OSError):
+        raise ValueError('Invalid expiration')
+    return None
+
+
+@views.route('/paste/bulk/', methods=['POST'])
+def paste_bulk():
+    HTTPDigestAuth().required()
+
+    # pastes are received as a json array or as ndjson, one object per line
+    items = []
+    errors = {}  # index -> error of the lines that aren't valid json
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        # json strings may contain line separators other than '\n'
+        lines = request.get_data(as_text=True).split('\n')
+        for lineno, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                errors[len(items)] = 'Invalid JSON in line %i' % lineno
+                items.append(None)
+    else:
+        try:
+            items = request.json
+        except:
+            abort(400)
+        if items is None:
+            abort(415)
+        if not isinstance(items, list):
+            abort(400)
+
+    if len(items) > int(current_app.config['BULK_MAX_ITEMS']):
+        abort(413)
+
+    results = [None] * len(items)
+    parsed = []
+    for i, data in enumerate(items):
+        if i in errors:
+            results[i] = dict(index=i, error=errors[i])
+            continue
+        try:
+            parsed.append((i, parse_paste(data)))
+        except ValueError as e:
+            results[i] = dict(index=i, error=str(e))
+
+    # guess the missing languages in parallel
+    missing = [(i, args) for i, args in parsed if args[2] is None]
+    languages = guess_pool.guess([(args[0], args[1])
+                                  for i, args in missing])
+    guessed = dict((i, language) for (i, args), language in
+                   zip(missing, languages))
+
+    # create all the pastes in a single transaction, with the private ids
+    # drawn at once
+    private_ids.reserve(len([args for i, args in parsed if args[3]]))
+
+    def create():
+        rv = []
+        for i, (file_content, file_name, language, private,
+                expires_at) in parsed:
+            paste = Paste(file_content, file_name, language or guessed[i],
+                          private, expires_at)
+            db.session.add(paste)
+            rv.append((i, paste))
+        return rv
+
+    pastes = commit_pastes(create)
+
+    for i, paste in pastes:
+        render_queue.submit(paste)
+        results[i] = dict(index=i, **paste.to_json(True))
+
+    # this api method isn't intended to be used in browsers, then we will
+    # return json for everybody.
+    return jsonify(dict(pastes=results))
+
+
+def accepts_stored_gzip(paste):
+    # pastes compressed with gzip are sent as-is to clients that accept it
+    return paste.blob.codec == 'gzip' and \
+        request.accept_encodings['gzip'] > 0
+
+
+def content_response(paste, gzip=False):
+    # the content is streamed from the database, then large pastes don't
+    # need to fit in memory
+    chunk_size = int(current_app.config['STREAM_CHUNK_SIZE'])
+    if gzip:
+        response = current_app.response_class(
+            paste.blob.stream(chunk_size, decompress=False),
+            direct_passthrough=True)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = current_app.response_class(
+            paste.blob.stream(chunk_size), direct_passthrough=True)
+        if paste.size_bytes is not None:
+            response.content_length = paste.size_bytes
     return response
 
 
@@ -48,26 +263,85 @@ class PasteAPI(MethodView):
         self.auth = HTTPDigestAuth()
         MethodView.__init__(self, *args, **kwargs)
 
+    # listings and pastes can be served by a read-only database
+    @reading()
     def get(self, paste_id=None, action=None):
 
         # paste listing
         if paste_id is None:
 
-            page = int(request.args.get('page', 1))
-            per_page = current_app.config['PER_PAGE']
+            private = request.args.get('private', '0') == '1'
 
             # private mode
-            if request.args.get('private', '0') == '1':
+            if private:
                 self.auth.required()
-                query = Paste.all(hide_private=False)
 
-            # normal mode
+            # full-text search
+            q = request.args.get('q', '').strip()
+            if q:
+                search = get_search_backend()
+                if search is None:
+                    abort(501)
+                query = search.query(q, hide_private=not private)
             else:
-                query = Paste.all()
+                query = Paste.all(hide_private=not private)
+
+            # cursor mode. seeks on the paste_id index, without counting the
+            # pastes, then it is fast even for the last pastes. search results
+            # are sorted by rank, then they can't use it.
+            if not q and ('before' in request.args or
+                          'limit' in request.args):
+                try:
+                    before = request.args.get('before') or None
+                    if before is not None:
+                        before = int(before)
+                    limit = int(request.args.get('limit') or
+                                current_app.config['PER_PAGE'])
+                except ValueError:
+                    abort(400)
+                limit = max(1, min(limit, current_app.config['PER_PAGE_MAX']))
+                pastes = Paste.all(hide_private=not private, before=before) \
+                    .limit(limit + 1).all()
+                cursor = None
+                if len(pastes) > limit:
+                    pastes = pastes[:limit]
+                    cursor = pastes[-1].paste_id
+
+                # json api
+                if request_wants_json():
+                    return jsonify(dict(pastes=[i.to_json(True) \
+                                                for i in pastes],
+                                        before=before, limit=limit,
+                                        next=cursor))
+
+                # html output
+                return render_html('pastes.html', pastes=pastes,
+                                   pagination=None, cursor=cursor,
+                                   limit=limit, private=private)
+
+            page = int(request.args.get('page', 1))
+            per_page = current_app.config['PER_PAGE']
 
-            pagination = query.paginate(page or 1, per_page)
+            # the number of pastes is read from the counters, instead of
+            # counting them. search results must be counted.
+            total = None
+            if not q:
+                total = PasteCounter.get(private and 'total' or 'public')
+            if total is None:
+                pagination = query.paginate(page or 1, per_page)
+            else:
+                page = page or 1
+                if page < 1:
+                    abort(404)
+                items = query.limit(per_page) \
+                    .offset((page - 1) * per_page).all()
+                if not items and page != 1:
+                    abort(404)
+                pagination = Pagination(query, page, per_page, total, items)
             kwargs = dict(page=pagination.page, pages=pagination.pages,
                           per_page=pagination.per_page, total=pagination.total)
+            if q:
+                kwargs.update(q=q)
 
             # json api
             if request_wants_json():
@@ -76,7 +350,8 @@ class PasteAPI(MethodView):
                                     **kwargs))
 
             # html output
-            return render_template('pastes.html', pagination=pagination)
+            return render_html('pastes.html', pastes=pagination.items,
+                               pagination=pagination, q=q, private=private)
 
         # paste rendering
         else:
@@ -88,40 +363,106 @@ class PasteAPI(MethodView):
                 self.auth.required()
 
             # guess output by browser's accept header
+            representation = action
             if action is None:
+                representation = request_wants_json() and 'json' or 'html'
+            elif action not in ('raw', 'download', 'lines'):
+
+                # no render found
+                abort(404)
+
+            # huge pastes are rendered in windows of lines, loaded on demand
+            window_size = int(current_app.config['PASTE_WINDOW_LINES'])
+            variant = ''
+            if representation == 'html':
+                variant = str(window_size)
+            elif representation == 'lines':
+                try:
+                    start = int(request.args.get('start') or 1)
+                    end = request.args.get('end') or None
+                    if end is not None:
+                        end = int(end)
+                except ValueError:
+                    abort(400)
+                if end is None and window_size > 0:
+                    end = start + window_size - 1
+                if start < 1 or (end is not None and end < start):
+                    abort(400)
+                if window_size > 0 and end - start >= window_size:
+                    abort(400)
+                variant = '%i:%s:%s' % (start, end or '',
+                                        request_wants_json() and 'json' or '')
+
+            # validators are built from the paste metadata, then unchanged
+            # pastes are answered without loading or rendering the content
+            gzip = representation in ('raw', 'download') and \
+                accepts_stored_gzip(paste)
+            if gzip:
+                variant = 'gzip'
+            etag = paste.etag(representation, variant, ownpaste.__version__)
+            if not is_resource_modified(request.environ, etag=etag,
+                                        last_modified=paste.last_modified):
+                response = current_app.response_class(status=304)
 
-                # json api
-                if request_wants_json():
-                    return jsonify(paste.to_json())
+            # json api
+            elif representation == 'json':
+                response = jsonify(paste.to_json())
 
-                # html output
-                return render_template('paste.html', paste=paste)
+            # html output
+            elif representation == 'html':
+                window = None
+                if window_size > 0 and (paste.line_count or 0) > window_size:
+                    html, line_count = paste.highlighted_window(1,
+                                                                window_size)
+                    window = dict(html=html, size=window_size,
+                                  end=min(window_size, line_count),
+                                  line_count=line_count)
+                response = make_response(render_html('paste.html',
+                                                     paste=paste,
+                                                     window=window))
+
+            # window of lines, for the html output
+            elif representation == 'lines':
+                html, line_count = paste.highlighted_window(start, end)
+                if start > line_count:
+                    abort(404)
+                if request_wants_json():
+                    response = jsonify(dict(start=start,
+                                            end=min(end or line_count,
+                                                    line_count),
+                                            line_count=line_count,
+                                            html=html))
+                else:
+                    response = make_response(html)
 
             # browser goodies
 
             # plain text output
-            if action == 'raw':
-                response = make_response(paste.file_content)
+            elif representation == 'raw':
+                response = content_response(paste, gzip)
                 response.headers['Content-Type'] = \
                     'text/plain; charset="utf-8"'
-                return response
 
             # force download
-            if action == 'download':
+            else:
                 content_type = 'application/octet-stream'
                 if len(paste.lexer.mimetypes):
                     content_type = paste.lexer.mimetypes[0]
                 file_name = 'untitled.txt'
                 if paste.file_name is not None:
                     file_name = os.path.basename(paste.file_name)
-                response = make_response(paste.file_content)
+                response = content_response(paste, gzip)
                 response.headers['Content-Type'] = content_type
                 response.headers['Content-Disposition'] = \
                     'attachment; filename="%s"' % file_name
-                return response
 
-            # no render found
-            abort(404)
+            response.set_etag(etag)
+            response.last_modified = paste.last_modified
+            if action in (None, 'lines'):
+                response.vary.add('Accept')
+            else:
+                response.vary.add('Accept-Encoding')
+            return response
 
     def post(self):
         self.auth.required()
@@ -134,21 +475,21 @@ class PasteAPI(MethodView):
         if data is None:
             abort(415)
 
-        file_name = data.get('file_name')
-        language = data.get('language')
-        private = data.get('private', False)
-        if not isinstance(private, bool):
-            abort(400)
         try:
-            file_content = data['file_content']
-        except KeyError:
+            file_content, file_name, language, private, expires_at = \
+                parse_paste(data)
+        except ValueError:
             abort(400)
 
         # create object
-        paste = Paste(file_content, file_name, language, private)
+        def create():
+            paste = Paste(file_content, file_name, language, private,
+                          expires_at)
+            db.session.add(paste)
+            return paste
 
-        db.session.add(paste)
-        db.session.commit()
+        paste = commit_pastes(create)
+        render_queue.submit(paste)
 
         # this api method isn't intended to be used in browsers, then we will
         # return json for everybody.
@@ -157,8 +498,8 @@ class PasteAPI(MethodView):
     def delete(self, paste_id):
         self.auth.required()
 
-        paste = paste = Paste.get(paste_id)
-        db.session.delete(paste)
+        paste = Paste.get(paste_id)
+        paste.remove()
         db.session.commit()
 
         # this api method isn't intended to be used in browsers, then we will
@@ -181,20 +522,32 @@ class PasteAPI(MethodView):
         private = data.get('private')
         file_content = data.get('file_content')
 
-        paste = Paste.get(paste_id)
-        if file_name is not None:
-            paste.file_name = file_name
-        if language is not None:
-            paste.language = language
-        if private is not None:
-            if not isinstance(private, bool):
-                abort(400)
-            paste.private = private
-        if file_content is not None:
-            if not isinstance(file_content, str):
+        if private is not None and not isinstance(private, bool):
+            abort(400)
+        for value in file_name, language, file_content:
+            if value is not None and not isinstance(value, str):
                 abort(400)
-            paste.set_file_content(file_content)
-        db.session.commit()
+
+        paste = Paste.get(paste_id)
+
+        def update():
+            changed = False
+            if file_name is not None:
+                paste.file_name = file_name
+            if language is not None and language != paste.language:
+                paste.language = language
+                paste.invalidate_rendered()
+                changed = True
+            if private is not None:
+                paste.private = private
+            if file_content is not None:
+                paste.set_file_content(file_content)
+                changed = True
+            paste.updated_at = datetime.utcnow()
+            return changed
+
+        if commit_pastes(update):
+            render_queue.submit(paste)
 
         # this api method isn't intended to be used in browsers, then we will
         # return json for everybody.
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+    ownpaste.workers
+    ~~~~~~~~~~~~~~~~
+
+    Module with background worker pools.
+
+    :copyright: (c) 2012-2013 by Rafael Goncalves Martins
+    :license: BSD, see LICENSE for more details.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from flask import current_app
+from ownpaste.highlight import cache as highlight_cache, join_lines
+from ownpaste.lexers import get_index, guess_language
+from ownpaste.models import Paste, RenderedPaste, db
+
+import multiprocessing
+import threading
+
+
+class RenderQueue(object):
+    '''Renders pastes on a thread pool, right after they are saved.
+
+    The rendered HTML is stored in the ``rendered_paste`` table, then the
+    first reader of a paste doesn't need to wait for Pygments. Pastes with
+    more than ``PASTE_WINDOW_LINES`` lines are stored as highlighted lines,
+    used by the windows of lines. The pool size
+    is set in the ``RENDER_WORKERS`` configuration parameter, and ``0``
+    disables it, rendering pastes lazily on the first read.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def _get_executor(self, workers):
+        # the executor is created lazily, then processes forked after the
+        # application creation will have their own threads.
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=workers)
+            return self.executor
+
+    def submit(self, paste):
+        workers = int(current_app.config['RENDER_WORKERS'])
+        if workers <= 0:
+            return None
+        app = current_app._get_current_object()
+        return self._get_executor(workers).submit(self._run, app,
+                                                  paste.paste_id)
+
+    def _run(self, app, paste_id):
+        with app.app_context():
+            try:
+                paste = Paste.query.get(paste_id)
+                if paste is None:
+                    return
+
+                # huge pastes are only shown in windows of lines, then their
+                # lines are rendered instead of the whole html
+                window_size = int(app.config['PASTE_WINDOW_LINES'])
+                if window_size > 0 and (paste.line_count or 0) > window_size:
+                    key = paste.render_lines_key
+                    rendered = paste.render_lines()
+                    html = join_lines(rendered)
+                else:
+                    key = paste.render_key
+                    rendered = html = paste.render()
+                RenderedPaste.query.filter(
+                    RenderedPaste.paste_id == paste_id).delete()
+                db.session.add(RenderedPaste(paste_id, key, html))
+                db.session.commit()
+                highlight_cache.set(key, rendered)
+            except Exception:
+                db.session.rollback()
+                app.logger.exception('Failed to render paste: %s', paste_id)
+            finally:
+                db.session.remove()
+
+
+def _guess(args):
+    return guess_language(*args)
+
+
+class GuessPool(object):
+    '''Guesses the language of many pastes in parallel, on a process pool.
+
+    The pool size is set in the ``BULK_WORKERS`` configuration parameter, and
+    ``0`` guesses the languages in the current process. Worker processes are
+    spawned, instead of forked, then they don't inherit the locks and
+    database connections of the server threads.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def _get_executor(self, workers):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=get_index)
+            return self.executor
+
+    def guess(self, items):
+        '''Returns the languages of a list of ``(file_content, file_name)``
+        tuples.'''
+        sample_size = int(current_app.config['LANGUAGE_GUESS_SAMPLE'])
+        timeout = current_app.config['LANGUAGE_GUESS_TIMEOUT']
+
+        # only the sample is analysed, then there's no need to send the
+        # whole content to the workers
+        args = [(file_content[:sample_size], file_name, sample_size, timeout)
+                for file_content, file_name in items]
+
+        workers = int(current_app.config['BULK_WORKERS'])
+        if workers <= 0 or len(args) < 2:
+            return [_guess(i) for i in args]
+        chunksize = max(1, len(args) // (workers * 4))
+        return list(self._get_executor(workers).map(_guess, args,
+                                                    chunksize=chunksize))
+
+
+render_queue = RenderQueue()
+guess_pool = GuessPool()
@@ -25,7 +25,7 @@ setup(
     author='Rafael G. Martins',
     author_email='rafael@rafaelmartins.eng.br',
     url='http://ownpaste.rtfd.org/',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     include_package_data=True,
     zip_safe=False,
     install_requires=[